@@ -1,6 +1,11 @@
 import base64
+import binascii
+import hashlib
+import re
+from html.parser import HTMLParser
+from io import BytesIO
 from pathlib import Path
-from typing import Tuple, Union
+from typing import Dict, Iterator, List, Tuple, Union
 from urllib.parse import unquote, urljoin, urlparse
 from uuid import uuid4
 
@@ -10,6 +15,109 @@ from bs4 import BeautifulSoup
 from PIL import Image
 
 
+BLOCK_TAGS = [
+    "address",
+    "article",
+    "aside",
+    "blockquote",
+    "dd",
+    "div",
+    "dl",
+    "dt",
+    "figcaption",
+    "figure",
+    "h1",
+    "h2",
+    "h3",
+    "h4",
+    "h5",
+    "h6",
+    "header",
+    "footer",
+    "hr",
+    "li",
+    "ol",
+    "p",
+    "pre",
+    "section",
+    "table",
+    "tr",
+    "ul",
+]
+TEXT_CHUNK_WORDS = 4096
+HTML_CHUNK_SIZE = 64 * 1024
+
+# Roughly the screen width of current e-readers, in pixels.
+TARGET_IMAGE_WIDTH = 1200
+LAZY_SRC_ATTRIBUTES = ["data-src", "data-lazy-src", "data-original"]
+SRCSET_ATTRIBUTES = ["data-srcset", "srcset"]
+UNSUPPORTED_SOURCE_TYPES = ["image/avif", "image/jxl"]
+
+IMAGE_CHUNK_SIZE = 64 * 1024
+# Multiple of 4, so chunks of clean base64 decode independently.
+DATA_URI_CHUNK_SIZE = 64 * 1024
+# Base64 data URIs in src attributes, swapped for placeholders before parsing.
+DATA_URI_SRC = re.compile(
+    r"""(?<=src=["'])data:image/[^;,"'\s]+;base64,[A-Za-z0-9+/=\s]*"""
+)
+DATA_URI_PLACEHOLDER_PREFIX = "readerlet-data-uri-"
+# Filled with a random token per parse and a counter.
+DATA_URI_PLACEHOLDER = DATA_URI_PLACEHOLDER_PREFIX + "{}-{}-"
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+MAX_IMAGE_PIXELS = 40_000_000
+# Images this small in both dimensions are spacers or tracking pixels.
+MIN_IMAGE_DIMENSION = 2
+IMAGE_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+]
+
+
+class ParagraphParser(HTMLParser):
+    """Incremental HTML parser collecting text paragraphs between block tags."""
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.paragraphs = []
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        if tag in BLOCK_TAGS:
+            self.end_paragraph()
+        elif tag == "br":
+            # Line breaks separate words within a paragraph.
+            self.parts.append(" ")
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in BLOCK_TAGS:
+            self.end_paragraph()
+        elif tag in ("td", "th"):
+            self.parts.append(" ")
+
+    def handle_data(self, data: str) -> None:
+        self.parts.append(data)
+
+    def end_paragraph(self) -> None:
+        # Text may arrive split mid-word, so join before splitting into words.
+        words = "".join(self.parts).split()
+        if words:
+            self.paragraphs.append(" ".join(words))
+        self.parts = []
+
+    def close(self) -> None:
+        super().close()
+        self.end_paragraph()
+
+    def pop_paragraphs(self) -> List[str]:
+        paragraphs, self.paragraphs = self.paragraphs, []
+        return paragraphs
+
+
 class Article:
     def __init__(
         self,
@@ -28,70 +136,347 @@ class Article:
         self.text_content = text_content
         self.images = []
 
+    def parse_content(self) -> Tuple[BeautifulSoup, Dict[str, Tuple[int, int]]]:
+        """Parse content with base64 data URIs swapped for short placeholders.
+
+        Keeps inline images out of the DOM. Returns the soup and, for each
+        placeholder, the span of its data URI in `self.content`. Placeholders
+        carry a random token, so article text cannot be mistaken for one.
+        """
+        data_uris = {}
+        token = uuid4().hex
+
+        def stash_data_uri(match: re.Match) -> str:
+            placeholder = DATA_URI_PLACEHOLDER.format(token, len(data_uris))
+            data_uris[placeholder] = match.span()
+            return placeholder
+
+        stashed = DATA_URI_SRC.sub(stash_data_uri, self.content)
+        return BeautifulSoup(stashed, "html.parser"), data_uris
+
+    def update_content(
+        self, soup: BeautifulSoup, data_uris: Dict[str, Tuple[int, int]]
+    ) -> None:
+        """Serialize soup into content, restoring the stashed data URIs."""
+        original = self.content
+
+        def restore_data_uri(match: re.Match) -> str:
+            start, end = data_uris[match.group()]
+            return original[start:end]
+
+        content = str(soup)
+        if data_uris:
+            placeholders = re.compile("|".join(map(re.escape, data_uris)))
+            content = placeholders.sub(restore_data_uri, content)
+        self.content = content
+
     def remove_hyperlinks(self) -> None:
         """Strip <a> tag attributes - keep the tags and content."""
-        soup = BeautifulSoup(self.content, "html.parser")
+        soup, data_uris = self.parse_content()
         for a in soup.find_all("a"):
             for attrb in list(a.attrs.keys()):
                 del a[attrb]
-        self.content = str(soup)
+        self.update_content(soup, data_uris)
 
     def remove_images(self) -> None:
         """Strip all image-related elements from content."""
         tags_to_remove = ["img", "figure", "picture"]
-        soup = BeautifulSoup(self.content, "html.parser")
+        soup, data_uris = self.parse_content()
         for tag in soup.find_all(tags_to_remove):
             tag.decompose()
-        self.content = str(soup)
+        self.update_content(soup, data_uris)
+
+    def iter_text(self, paragraphs: bool = False) -> Iterator[str]:
+        """Yield whitespace-normalised text in chunks.
+
+        Plain text is built from `text_content`. With `paragraphs`, text is
+        rendered from the HTML content with blank lines between paragraphs.
+        """
+        if paragraphs:
+            for i, paragraph in enumerate(self.iter_paragraphs()):
+                yield paragraph if i == 0 else "\n\n" + paragraph
+            return
+
+        words = []
+        first = True
+        for match in re.finditer(r"\S+", self.text_content):
+            words.append(match.group())
+            if len(words) == TEXT_CHUNK_WORDS:
+                yield ("" if first else " ") + " ".join(words)
+                words = []
+                first = False
+        if words:
+            yield ("" if first else " ") + " ".join(words)
+
+    def iter_html(self) -> Iterator[str]:
+        """Yield HTML content in slices of HTML_CHUNK_SIZE characters."""
+        for position in range(0, len(self.content), HTML_CHUNK_SIZE):
+            yield self.content[position : position + HTML_CHUNK_SIZE]
+
+    def iter_paragraphs(self) -> Iterator[str]:
+        """Yield whitespace-normalised paragraphs from the HTML content.
+
+        The HTML is parsed incrementally, so each paragraph is yielded as soon
+        as its block ends rather than after the whole document is parsed.
+        """
+        parser = ParagraphParser()
+        for chunk in self.iter_html():
+            parser.feed(chunk)
+            yield from parser.pop_paragraphs()
+        parser.close()
+        yield from parser.pop_paragraphs()
 
     @staticmethod
-    def download_image(url: str, temp_dir: Path) -> Union[Tuple[Path, str], None]:
+    def download_image(
+        url: str, temp_dir: Path, max_bytes: int = MAX_IMAGE_BYTES
+    ) -> Union[Tuple[Path, str], None]:
         """Download image. Return downloaded image path and extension."""
         try:
             if "data:image" in url and "base64" in url:
-                mimetype = url.split(":")[1].split(";")[0]
-                extension = mimetype.split("/")[1]
-                url = url.split("base64,")[1]
-                data = base64.b64decode(url)
-                image_path = temp_dir / (str(uuid4()) + "." + extension)
+                return Article.save_data_uri(url, 0, len(url), temp_dir)
 
-                with open(image_path, "wb") as img:
-                    img.write(data)
+            response = requests.get(url, stream=True, timeout=10)
 
-                return image_path, extension
+            with response:
+                response.raise_for_status()
 
-            response = requests.get(url, stream=True, timeout=10)
-            response.raise_for_status()
+                content_length = response.headers.get("Content-Length", "")
+                if content_length.isdigit() and int(content_length) > max_bytes:
+                    return None
 
-            if "." in urlparse(url).path:
-                extension = urlparse(url).path.split(".")[-1]
-                image_name = urlparse(url).path.split("/")[-1]
+                chunks = iter(response.iter_content(IMAGE_CHUNK_SIZE))
+                head = next(chunks, b"")
 
-            elif response.headers.get("Content-Type", "").startswith("image/"):
-                extension = response.headers["Content-Type"].split("/")[1]
-                image_name = str(uuid4()) + "." + extension
+                # Decide on the first chunk, before the rest is transferred.
+                sniffed, size = Article.sniff_image(head)
+                if sniffed is None and head.lstrip()[:1] == b"<":
+                    return None
+                if size and not Article.acceptable_size(size):
+                    return None
 
-            else:
-                return None
+                path = unquote(urlparse(url).path)
+                if "." in path:
+                    extension = path.split(".")[-1]
+                    image_name = path.split("/")[-1]
 
-            image_path = temp_dir / image_name
+                elif response.headers.get("Content-Type", "").startswith("image/"):
+                    extension = response.headers["Content-Type"].split("/")[1]
+                    image_name = str(uuid4()) + "." + extension
 
-            with open(image_path, "wb") as img:
-                for chunk in response.iter_content(1024):
-                    img.write(chunk)
+                elif sniffed:
+                    extension = sniffed
+                    image_name = str(uuid4()) + "." + extension
+
+                else:
+                    return None
+
+                # Trust the bytes over the URL, e.g. WebP served as .jpg.
+                if sniffed and sniffed != extension.lower().replace("jpeg", "jpg"):
+                    extension = sniffed
+                    image_name = Path(image_name).stem + "." + extension
+
+                image_path = Article.unique_path(temp_dir, image_name)
+
+                with open(image_path, "wb") as img:
+                    img.write(head)
+                    written = len(head)
+                    for chunk in chunks:
+                        written += len(chunk)
+                        if written > max_bytes:
+                            break
+                        img.write(chunk)
+
+                if written > max_bytes:
+                    image_path.unlink()
+                    return None
 
             return image_path, extension
 
-        except (OSError, requests.exceptions.RequestException, base64.binascii.Error):
+        except (
+            OSError,
+            requests.exceptions.RequestException,
+            binascii.Error,
+            Image.DecompressionBombError,
+        ):
+            return None
+
+    @staticmethod
+    def save_data_uri(
+        text: str, start: int, end: int, temp_dir: Path
+    ) -> Union[Tuple[Path, str], None]:
+        """Decode base64 data URI at text[start:end] to a file, chunk by chunk.
+
+        The URI is read in place, so the payload is never copied out whole.
+        """
+        comma = text.find(",", start, end)
+        header = text[start:comma]
+        if comma == -1 or not header.startswith("data:image/"):
+            return None
+        if not header.endswith(";base64"):
             return None
 
+        subtype = header[len("data:image/") :].split(";")[0]
+        extension = subtype.split("+")[0]
+        image_path = temp_dir / (str(uuid4()) + "." + extension)
+
+        try:
+            with open(image_path, "wb") as img:
+                pending = ""
+                for position in range(comma + 1, end, DATA_URI_CHUNK_SIZE):
+                    chunk = text[position : min(position + DATA_URI_CHUNK_SIZE, end)]
+                    chunk = pending + "".join(chunk.split())
+                    usable = len(chunk) - len(chunk) % 4
+                    img.write(base64.b64decode(chunk[:usable]))
+                    pending = chunk[usable:]
+                if pending:
+                    img.write(base64.b64decode(pending))
+            # Same size limits as downloads, e.g. against tracking pixels.
+            with open(image_path, "rb") as img:
+                _, size = Article.sniff_image(img.read(IMAGE_CHUNK_SIZE))
+            if size and not Article.acceptable_size(size):
+                image_path.unlink()
+                return None
+        except (OSError, binascii.Error, Image.DecompressionBombError):
+            image_path.unlink(missing_ok=True)
+            return None
+
+        return image_path, extension
+
+    @staticmethod
+    def sniff_image(
+        head: bytes,
+    ) -> Tuple[Union[str, None], Union[Tuple[int, int], None]]:
+        """Guess image extension and dimensions from the first bytes of a file.
+
+        Raises DecompressionBombError for headers claiming huge dimensions.
+        """
+        extension = None
+        for signature, sig_extension in IMAGE_SIGNATURES:
+            if head.startswith(signature):
+                extension = sig_extension
+        if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+            extension = "webp"
+        elif head[4:12] in (b"ftypavif", b"ftypavis"):
+            extension = "avif"
+        elif b"<svg" in head[:1024].lower():
+            return "svg", None
+
+        try:
+            with Image.open(BytesIO(head)) as image:
+                return extension, image.size
+        except Image.DecompressionBombError:
+            # Header claims far more pixels than MAX_IMAGE_PIXELS: reject.
+            raise
+        except Exception:
+            # Pillow raises a range of errors on unknown or truncated headers.
+            return extension, None
+
+    @staticmethod
+    def acceptable_size(size: Tuple[int, int]) -> bool:
+        """Reject tracking pixels and images too large to be worth converting."""
+        width, height = size
+        if width <= MIN_IMAGE_DIMENSION and height <= MIN_IMAGE_DIMENSION:
+            return False
+        return width * height <= MAX_IMAGE_PIXELS
+
+    @staticmethod
+    def unique_path(directory: Path, name: str) -> Path:
+        """Return path for file name in directory, renamed if already taken."""
+        path = directory / name
+        if path.exists():
+            path = directory / f"{path.stem}-{uuid4().hex[:8]}{path.suffix}"
+        return path
+
+    @staticmethod
+    def file_digest(path: Path) -> str:
+        """Return SHA-256 hex digest of file contents."""
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def parse_srcset(srcset: str) -> List[Tuple[str, str]]:
+        """Split srcset into (url, descriptor) candidates."""
+        candidates = []
+        position = 0
+        while True:
+            match = re.compile(r"[\s,]*(\S+)").match(srcset, position)
+            if not match:
+                return candidates
+            url, position = match.group(1), match.end()
+            descriptor = ""
+            if url.endswith(","):
+                url = url.rstrip(",")
+            else:
+                end = srcset.find(",", position)
+                end = len(srcset) if end == -1 else end
+                descriptor = srcset[position:end].strip()
+                position = end + 1
+            if url:
+                candidates.append((url, descriptor))
+
+    @staticmethod
+    def select_image_source(img_tag, target_width: int) -> Union[str, None]:
+        """Pick the image URL closest to target width.
+
+        Considers <picture> sources and (data-)srcset candidates first, then
+        lazy-load attributes and finally src. Picks the smallest candidate at
+        least target width wide, or the largest one if all are smaller.
+        Inline data URIs, typically lazy-load placeholders, are only picked
+        when there is nothing else.
+        """
+        srcsets = []
+        if img_tag.parent and img_tag.parent.name == "picture":
+            for source in img_tag.parent.find_all("source"):
+                if source.get("type") not in UNSUPPORTED_SOURCE_TYPES:
+                    srcsets.append(source.get("data-srcset") or source.get("srcset"))
+        srcsets.extend(img_tag.get(attr) for attr in SRCSET_ATTRIBUTES)
+
+        # Density descriptors are relative to the rendered width, when known.
+        width = img_tag.get("width", "")
+        base_width = int(width) if width.isdigit() else target_width // 2
+
+        candidates = []
+        for srcset in filter(None, srcsets):
+            for url, descriptor in Article.parse_srcset(srcset):
+                try:
+                    if descriptor.endswith("w"):
+                        candidate_width = int(descriptor[:-1])
+                    elif descriptor.endswith("x"):
+                        candidate_width = float(descriptor[:-1]) * base_width
+                    else:
+                        candidate_width = base_width
+                except ValueError:
+                    continue
+                candidates.append((candidate_width, url))
+
+        remote = [c for c in candidates if not Article.is_inline(c[1])]
+        candidates = remote or candidates
+        if candidates:
+            large_enough = [c for c in candidates if c[0] >= target_width]
+            if large_enough:
+                return min(large_enough, key=lambda c: c[0])[1]
+            return max(candidates, key=lambda c: c[0])[1]
+
+        sources = [img_tag.get(attr) for attr in LAZY_SRC_ATTRIBUTES + ["src"]]
+        sources = [source for source in sources if source]
+        remote = [source for source in sources if not Article.is_inline(source)]
+        return (remote or sources or [None])[0]
+
+    @staticmethod
+    def is_inline(url: str) -> bool:
+        """Whether image URL is a data URI, or the placeholder standing in for one."""
+        return url.startswith(("data:", DATA_URI_PLACEHOLDER_PREFIX))
+
     @staticmethod
     def convert_image(temp_dir: Path, image_path: Path) -> Union[Path, None]:
         """Convert unsupported image type to PNG for EPUB/Kindle compatibility."""
         # TODO: avif
         try:
             image = Image.open(image_path)
-            png_path = temp_dir / (image_path.stem + ".png")
+            png_path = Article.unique_path(temp_dir, image_path.stem + ".png")
             image.save(png_path, format="PNG")
             return png_path
         except (OSError, ValueError):
@@ -99,9 +484,10 @@ class Article:
         finally:
             image_path.unlink(missing_ok=True)
 
-    def extract_images(self, temp_dir: Path, for_kindle: bool) -> None:
+    def extract_images(
+        self, temp_dir: Path, for_kindle: bool, target_width: int = TARGET_IMAGE_WIDTH
+    ) -> None:
         """Download images and replace src with local path."""
-        # TODO: src vs data-src.
 
         EPUB_IMAGE_TYPES = {
             "png": "image/png",
@@ -112,15 +498,48 @@ class Article:
             "webp": "image/webp",
         }
 
-        soup = BeautifulSoup(self.content, "html.parser")
+        # Inline images are decoded from their span in the unparsed content.
+        soup, data_uris = self.parse_content()
+
+        # Images already handled in this run, by URL and by content digest.
+        # Each maps to (image name, mimetype), or None for failed URLs.
+        by_url = {}
+        by_digest = {}
 
         for img_tag in soup.find_all("img"):
-            src = img_tag.get("src")
+            src = self.select_image_source(img_tag, target_width)
+
+            # Keep only the chosen image: drop responsive alternatives.
+            for attr in SRCSET_ATTRIBUTES + LAZY_SRC_ATTRIBUTES + ["sizes"]:
+                if attr in img_tag.attrs:
+                    del img_tag[attr]
+            if img_tag.parent and img_tag.parent.name == "picture":
+                for source in img_tag.parent.find_all("source"):
+                    source.decompose()
+                img_tag.parent.unwrap()
 
             if src:
-                absolute_url = unquote(urljoin(self.url, src)).strip()
-                absolute_url = absolute_url.split("?")[0]
-                image = self.download_image(absolute_url, temp_dir)
+                if src in data_uris:
+                    absolute_url = src
+                    label = "data URI"
+                else:
+                    # Left encoded: decoding would merge parameters of nested
+                    # URLs (e.g. image proxies) into the outer query string.
+                    absolute_url = urljoin(self.url, src).strip()
+                    label = src
+
+                if absolute_url in by_url:
+                    if by_url[absolute_url] is None:
+                        img_tag.decompose()
+                    else:
+                        img_tag["src"] = f"images/{by_url[absolute_url][0]}"
+                    continue
+
+                if src in data_uris:
+                    start, end = data_uris.pop(src)
+                    image = self.save_data_uri(self.content, start, end, temp_dir)
+                else:
+                    image = self.download_image(absolute_url, temp_dir)
 
                 if image:
                     image_path, extension = image
@@ -131,17 +550,31 @@ class Article:
                         mimetype = "image/png"
 
                         if not image_path:
+                            by_url[absolute_url] = None
                             img_tag.decompose()
-                            click.echo(f"Failed to convert image: {src}")
+                            click.echo(f"Failed to convert image: {label}")
                             continue
 
-                    image_name = Path(image_path).name
+                    digest = self.file_digest(image_path)
+
+                    if digest in by_digest:
+                        image_name, mimetype = by_digest[digest]
+                        if Path(image_path).name != image_name:
+                            Path(image_path).unlink()
+                        click.echo(f"Duplicate image: images/{image_name}")
+                    else:
+                        image_name = Path(image_path).name
+                        by_digest[digest] = (image_name, mimetype)
+                        self.images.append((image_name, mimetype))
+                        click.echo(f"Downloaded: images/{image_name}")
+
+                    by_url[absolute_url] = (image_name, mimetype)
                     img_tag["src"] = f"images/{image_name}"
-                    self.images.append((image_name, mimetype))
-                    click.echo(f"Downloaded: images/{image_name}")
 
                 else:
-                    click.echo(f"Failed to download image: {src}")
+                    by_url[absolute_url] = None
+                    click.echo(f"Failed to download image: {label}")
                     img_tag.decompose()
 
-        self.content = str(soup)
+        # Data URIs that were not used as an image source are restored.
+        self.update_content(soup, data_uris)
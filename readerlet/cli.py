@@ -1,17 +1,19 @@
+import codecs
 import json
 import os
-import re
 import subprocess
 from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, Union
 from urllib.parse import urlparse
 
 import click
 import stkclient
-from bs4 import BeautifulSoup
 from stkclient.api import APIError
 
 from readerlet.article import Article
+from readerlet.delivery import deliver, load_targets
 from readerlet.epub import create_epub
+from readerlet.ingest import StateStore, content_hash, default_state_path, load_source
 
 
 def check_node_installed() -> bool:
@@ -48,44 +50,115 @@ def install_npm_packages() -> None:
         raise click.ClickException("Node.js runtime not found.")
 
 
-def extract_content(url: str) -> Article:
+METADATA_FIELDS = ("title", "byline", "lang")
+FRAME_CHUNK_SIZE = 64 * 1024
+
+
+def read_frames(stream: BinaryIO) -> Dict[str, str]:
+    """Read length-prefixed frames written by extract_stdout.js.
+
+    Each frame is an ASCII header line "<field> <byte length>" followed by the
+    UTF-8 payload. Payloads are read and decoded in chunks so large fields are
+    never held in the pipe buffer and as a full bytes copy at the same time.
+    """
+    fields = {}
+    while True:
+        header = stream.readline()
+        if not header:
+            return fields
+
+        name, size = header.decode("ascii").split()
+        remaining = int(size)
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        parts = []
+        while remaining > 0:
+            chunk = stream.read(min(remaining, FRAME_CHUNK_SIZE))
+            if not chunk:
+                raise ValueError(f"Truncated frame: {name}")
+            remaining -= len(chunk)
+            parts.append(decoder.decode(chunk))
+        parts.append(decoder.decode(b"", final=True))
+        fields[name] = "".join(parts)
+
+
+class ContentRejected(click.ClickException):
+    """Extracted article fell below the quality thresholds."""
+
+
+class PageNotReaderable(ContentRejected):
+    """Page failed Readability's readerable pre-check."""
+
+
+def extract_content(
+    url: str,
+    fields: Iterable[str] = ("content", "textContent"),
+    precheck: bool = False,
+    min_length: int = 0,
+    max_link_density: float = 1.0,
+) -> Article:
+    """Extract article with readability, transferring only the requested fields.
+
+    `fields` selects which of "content" and "textContent" are sent back by node.
+    With `precheck`, pages that fail Readability's isProbablyReaderable are
+    rejected before the full parse. Extracted articles with less than
+    `min_length` characters of text, or a larger share of link text than
+    `max_link_density`, are rejected too.
+    """
     current_dir = os.path.dirname(os.path.abspath(__file__))
     js_script_path = os.path.join(current_dir, "js", "extract_stdout.js")
+    fields = tuple(fields)
+
+    args = ["node", js_script_path, url, *METADATA_FIELDS, *fields]
+    if min_length:
+        args.append("length")
+    if max_link_density < 1:
+        args.append("linkDensity")
+    if precheck:
+        args.append("--precheck")
 
     try:
-        readability = subprocess.run(
-            ["node", js_script_path, url],
-            capture_output=True,
-            text=True,
-            check=True,
-        )
-        article_data = json.loads(readability.stdout)
+        with subprocess.Popen(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        ) as readability:
+            article_data = read_frames(readability.stdout)
+    except (OSError, ValueError):
+        raise click.ClickException("Failed to extract article.")
 
-        if article_data:
-            title = (
-                article_data["title"]
-                if article_data["title"] is not None
-                else urlparse(url).netloc
-            )
-            byline = (
-                article_data["byline"]
-                if article_data["byline"] is not None
-                else urlparse(url).netloc
-            )
-            lang = (
-                article_data["lang"]
-                if article_data["lang"] and article_data["lang"].strip()
-                else "en"
-            )
-            content = article_data.get("content")
-            text_content = re.sub(r"\s+", " ", article_data.get("textContent", ""))
-            # TODO: date
-            if not content:
-                raise click.ClickException("Content not extracted.")
-            return Article(url, title, byline, lang, content, text_content)
-    except subprocess.CalledProcessError:
+    if readability.returncode != 0:
         raise click.ClickException("Failed to extract article.")
 
+    if "rejected" in article_data:
+        raise PageNotReaderable("Page does not look like an article.")
+
+    title = article_data.get("title") or urlparse(url).netloc
+    byline = article_data.get("byline") or urlparse(url).netloc
+    lang = (
+        article_data["lang"]
+        if article_data.get("lang") and article_data["lang"].strip()
+        else "en"
+    )
+    content = article_data.get("content", "")
+    text_content = article_data.get("textContent", "")
+    # TODO: date
+    if ("content" in fields and not content) or (
+        "textContent" in fields and not text_content.strip()
+    ):
+        raise click.ClickException("Content not extracted.")
+
+    try:
+        length = int(article_data.get("length", 0))
+        link_density = float(article_data.get("linkDensity", 0))
+    except ValueError:
+        raise click.ClickException("Failed to extract article.")
+    if length < min_length:
+        raise ContentRejected(f"Content too short: {length} characters.")
+    if link_density > max_link_density:
+        raise ContentRejected(f"Content is mostly links: {link_density:.0%}.")
+
+    return Article(url, title, byline, lang, content, text_content)
+
 
 @click.group()
 @click.version_option()
@@ -116,7 +189,15 @@ def cli() -> None:
     default=False,
     help="Remove image-related elements from content.",
 )
-def send(source: str, remove_hyperlinks: bool, remove_images: bool) -> None:
+@click.option(
+    "--fan-out",
+    is_flag=True,
+    default=False,
+    help="Deliver to all targets in delivery_config.json instead of Kindle only.",
+)
+def send(
+    source: str, remove_hyperlinks: bool, remove_images: bool, fan_out: bool
+) -> None:
     """Send content to Kindle.
 
     SOURCE: URL or a path to a local file.
@@ -155,35 +236,214 @@ def send(source: str, remove_hyperlinks: bool, remove_images: bool) -> None:
         # Use the file name for both when sending a local file.
         file_name = Path(source).stem
 
-        click.echo("Sending file to Kindle...")
-        kindle_send(
-            Path(source), author=file_name, title=file_name, format=file_extension[1:]
-        )
+        if fan_out:
+            deliver_file(Path(source), file_name, file_name, file_extension[1:])
+        else:
+            click.echo("Sending file to Kindle...")
+            kindle_send(
+                Path(source),
+                author=file_name,
+                title=file_name,
+                format=file_extension[1:],
+            )
         click.secho("File sent.", fg="green")
 
     else:
         install_npm_packages()
-        article = extract_content(source)
+        article = extract_content(source, fields=("content",))
+        send_article(article, remove_hyperlinks, remove_images, fan_out)
 
-        if remove_hyperlinks:
-            article.remove_hyperlinks()
 
-        if remove_images:
-            article.remove_images()
+def send_article(
+    article: Article,
+    remove_hyperlinks: bool,
+    remove_images: bool,
+    fan_out: bool = False,
+) -> None:
+    """Package extracted article as EPUB and send it to Kindle.
 
-        try:
-            click.echo("Creating EPUB...")
-            epub_path = create_epub(
-                article,
-                str(Path(__file__).parent.resolve()),
-                remove_images,
-                for_kindle=True,
-            )
+    With `fan_out`, deliver it to all configured delivery targets instead."""
+
+    if remove_hyperlinks:
+        article.remove_hyperlinks()
+
+    if remove_images:
+        article.remove_images()
+
+    click.echo("Creating EPUB...")
+    epub_path = create_epub(
+        article,
+        str(Path(__file__).parent.resolve()),
+        remove_images,
+        for_kindle=True,
+    )
+    try:
+        if fan_out:
+            deliver_file(epub_path, article.byline, article.title, format="EPUB")
+        else:
             click.echo("Sending to Kindle...")
             kindle_send(epub_path, article.byline, article.title, format="EPUB")
-            click.secho("EPUB sent.", fg="green")
-        finally:
-            epub_path.unlink(missing_ok=True)
+        click.secho("EPUB sent.", fg="green")
+    finally:
+        epub_path.unlink(missing_ok=True)
+
+
+def deliver_file(filepath: Path, author: str, title: str, format: str) -> None:
+    """Deliver file concurrently to the targets in delivery_config.json."""
+
+    config_file = "delivery_config.json"
+    cfg = Path(click.get_app_dir("readerlet"), config_file)
+    targets, options = load_targets(cfg, kindle_send)
+
+    click.echo(f"Delivering to {len(targets)} targets...")
+    results = deliver(filepath, author, title, format, targets, **options)
+
+    for result in results:
+        if result.ok:
+            click.echo(
+                f"  {result.target}: sent in {result.duration:.1f}s "
+                f"({result.attempts} attempt(s))."
+            )
+        else:
+            click.secho(
+                f"  {result.target}: failed after {result.attempts} attempt(s): "
+                f"{result.error}",
+                fg="red",
+            )
+
+    failed = [result for result in results if not result.ok]
+    if failed:
+        raise click.ClickException(
+            f"Delivery failed for {len(failed)} of {len(results)} targets."
+        )
+
+
+@cli.command()
+@click.argument("source", required=True, type=str)
+@click.option(
+    "--remove-hyperlinks",
+    "-h",
+    is_flag=True,
+    default=False,
+    help="Remove hyperlinks from content.",
+)
+@click.option(
+    "--remove-images",
+    "-i",
+    is_flag=True,
+    default=False,
+    help="Remove image-related elements from content.",
+)
+@click.option(
+    "--mark-only",
+    is_flag=True,
+    default=False,
+    help="Record new items as processed without extracting or sending them.",
+)
+@click.option(
+    "--precheck/--no-precheck",
+    default=True,
+    show_default=True,
+    help="Skip pages that do not look like articles before full extraction.",
+)
+@click.option(
+    "--min-length",
+    type=click.IntRange(min=0),
+    default=500,
+    show_default=True,
+    help="Skip articles with fewer characters of text.",
+)
+@click.option(
+    "--max-link-density",
+    type=click.FloatRange(0, 1),
+    default=0.5,
+    show_default=True,
+    help="Skip articles with a larger share of text inside links.",
+)
+@click.option(
+    "--fan-out",
+    is_flag=True,
+    default=False,
+    help="Deliver to all targets in delivery_config.json instead of Kindle only.",
+)
+def ingest(
+    source: str,
+    remove_hyperlinks: bool,
+    remove_images: bool,
+    mark_only: bool,
+    precheck: bool,
+    min_length: int,
+    max_link_density: float,
+    fan_out: bool,
+) -> None:
+    """Send new articles from a feed or link list to Kindle.
+
+    SOURCE: URL or path of an RSS/Atom feed, HTML bookmarks export or a
+    plain list of URLs, one per line.
+
+    Processed URLs and content hashes are kept in a local state database,
+    so items that were already sent are skipped on later runs."""
+
+    urls = load_source(source)
+
+    with StateStore(default_state_path()) as store:
+        new_urls = [
+            url
+            for url in urls
+            if not store.is_processed(url, min_length, max_link_density)
+        ]
+        click.echo(f"Found {len(urls)} items, {len(new_urls)} new.")
+
+        if mark_only:
+            for url in new_urls:
+                store.record(url)
+            click.secho(f"Marked {len(new_urls)} items as processed.", fg="green")
+            return
+
+        if new_urls:
+            install_npm_packages()
+
+        sent = skipped = rejected = failed = 0
+        for url in new_urls:
+            click.echo(f"Processing: {url}")
+            try:
+                article = extract_content(
+                    url,
+                    fields=("content",),
+                    precheck=precheck,
+                    min_length=min_length,
+                    max_link_density=max_link_density,
+                )
+                digest = content_hash(article.content)
+                if store.has_hash(digest):
+                    click.echo("Content already sent, skipping.")
+                    store.record(url, digest)
+                    skipped += 1
+                    continue
+                send_article(article, remove_hyperlinks, remove_images, fan_out)
+                store.record(url, digest)
+                sent += 1
+            except ContentRejected as e:
+                click.echo(f"Rejected: {e.format_message()}")
+                # Not an article: record it so later runs do not retry it.
+                # Below the limits: retried only once the limits are relaxed.
+                if isinstance(e, PageNotReaderable):
+                    store.record(url)
+                else:
+                    store.record(
+                        url,
+                        min_length=min_length,
+                        max_link_density=max_link_density,
+                    )
+                rejected += 1
+            except click.ClickException as e:
+                click.secho(f"Failed: {url}: {e.format_message()}", fg="red")
+                failed += 1
+
+    click.echo(
+        f"Sent: {sent}, duplicates skipped: {skipped}, "
+        f"rejected: {rejected}, failed: {failed}."
+    )
 
 
 @cli.command()
@@ -211,20 +471,37 @@ def send(source: str, remove_hyperlinks: bool, remove_images: bool) -> None:
 @click.option(
     "--stdout",
     "-o",
-    type=click.Choice(["html", "text"]),
-    help="Print content to stdout. Specify the output format (html or text without html).",
+    type=click.Choice(["html", "text", "jsonl"]),
+    help="Print content to stdout. Specify the output format (html, text without html or jsonl with one paragraph and metadata per line).",
+)
+@click.option(
+    "--paragraphs",
+    "-p",
+    is_flag=True,
+    default=False,
+    help="Preserve paragraph breaks in text output.",
 )
 def extract(
     url: str,
     output_epub: str,
     remove_hyperlinks: bool,
     remove_images: bool,
-    stdout: bool,
+    stdout: str,
+    paragraphs: bool,
 ) -> None:
     """Extract and format web content, save as EPUB or print to stdout."""
 
+    if paragraphs and stdout != "text":
+        raise click.UsageError("Flag -p can only be used with '-o text'.")
+
+    fields = []
+    if output_epub or stdout in ("html", "jsonl") or paragraphs:
+        fields.append("content")
+    if stdout == "text" and not paragraphs:
+        fields.append("textContent")
+
     install_npm_packages()
-    article = extract_content(url)
+    article = extract_content(url, fields)
 
     if remove_hyperlinks:
         article.remove_hyperlinks()
@@ -238,11 +515,26 @@ def extract(
         click.secho(f"EPUB created: {epub_path}", fg="green")
 
     if stdout == "html":
-        c = BeautifulSoup(article.content, "html.parser")
-        click.echo(str(c))
+        for chunk in article.iter_html():
+            click.echo(chunk, nl=False)
+        click.echo()
 
     elif stdout == "text":
-        click.echo(article.text_content)
+        for chunk in article.iter_text(paragraphs):
+            click.echo(chunk, nl=False)
+        click.echo()
+
+    elif stdout == "jsonl":
+        for i, paragraph in enumerate(article.iter_paragraphs()):
+            record = {
+                "url": article.url,
+                "title": article.title,
+                "byline": article.byline,
+                "lang": article.lang,
+                "paragraph": i,
+                "text": paragraph,
+            }
+            click.echo(json.dumps(record, ensure_ascii=False))
 
 
 @cli.command()
@@ -278,11 +570,19 @@ def kindle_login() -> None:
             break
 
 
-def kindle_send(filepath: Path, author: str, title: str, format: str) -> None:
-    """Send EPUB to Kindle via the send to kindle client."""
+def kindle_send(
+    filepath: Path,
+    author: str,
+    title: str,
+    format: str,
+    config_path: Union[Path, None] = None,
+) -> None:
+    """Send EPUB to Kindle via the send to kindle client.
+
+    Uses the credentials saved by kindle-login unless `config_path` is given."""
 
     config_file = "kindle_config.json"
-    cfg = Path(click.get_app_dir("readerlet"), config_file)
+    cfg = config_path or Path(click.get_app_dir("readerlet"), config_file)
 
     if not cfg.exists():
         raise click.ClickException(
@@ -302,14 +602,16 @@ def kindle_send(filepath: Path, author: str, title: str, format: str) -> None:
         client.send_file(
             filepath, destinations, author=author, title=title, format=format
         )
-    except APIError:
+    except APIError as e:
         if before_sending:
-            raise click.ClickException("Re-authenticate with 'readerlet kindle-login'.")
+            raise click.ClickException(
+                "Re-authenticate with 'readerlet kindle-login'."
+            ) from e
         else:
             raise click.ClickException(
                 "Failed to send file. Check the file format and content."
-            )
+            ) from e
     except json.JSONDecodeError:
         raise click.ClickException(f"File '{cfg}' is not a valid JSON file.")
     except Exception as e:
-        raise click.ClickException(e)
+        raise click.ClickException(e) from e
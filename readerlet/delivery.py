@@ -0,0 +1,242 @@
+import json
+import shutil
+import smtplib
+import socket
+import time
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Tuple, Union
+
+import click
+
+from readerlet.mailer import Mailer
+
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 1.0
+# Network failures that may clear up on their own. Anything else, such as
+# rejected credentials or a missing config file, fails on the first attempt.
+TRANSIENT_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    # Not a TimeoutError subclass before Python 3.10.
+    socket.timeout,
+    socket.gaierror,
+    smtplib.SMTPServerDisconnected,
+)
+
+
+class KindleTarget:
+    """Send-to-Kindle account, given by its stkclient credentials file."""
+
+    def __init__(self, config_path: Path, kindle_send: Callable):
+        self.config_path = config_path
+        self.kindle_send = kindle_send
+        self.name = f"kindle:{config_path.name}"
+
+    def send(self, filepath: Path, author: str, title: str, format: str) -> None:
+        self.kindle_send(filepath, author, title, format, config_path=self.config_path)
+
+
+class EmailTarget:
+    """Kindle email address, reached through the configured SMTP account."""
+
+    def __init__(self, mailer: Mailer):
+        self.mailer = mailer
+        self.name = f"email:{mailer.kindle_email}"
+
+    def send(self, filepath: Path, author: str, title: str, format: str) -> None:
+        self.mailer.send_attachment(filepath)
+
+
+class DirectoryTarget:
+    """Local directory the file is copied into."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.name = f"directory:{path}"
+
+    def send(self, filepath: Path, author: str, title: str, format: str) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        shutil.copy(filepath, self.path / filepath.name)
+
+
+Target = Union[KindleTarget, EmailTarget, DirectoryTarget]
+
+
+class DeliveryResult:
+    def __init__(
+        self, target: str, ok: bool, attempts: int, duration: float, error: str = ""
+    ):
+        self.target = target
+        self.ok = ok
+        self.attempts = attempts
+        self.duration = duration
+        self.error = error
+
+
+def load_targets(cfg: Path, kindle_send: Callable) -> Tuple[List[Target], dict]:
+    """Load delivery targets and options from a delivery config json file.
+
+    `kindle_send` performs the upload for Kindle account targets.
+    """
+    if not cfg.exists():
+        raise click.ClickException(
+            f"Delivery configuration json file not found at {cfg}. "
+            f"See example config format:\n\n"
+            f"{{'max_workers': 4, 'retries': 2,\n"
+            f"'targets': [\n"
+            f"  {{'type': 'kindle', 'config': 'kindle_config.json'}},\n"
+            f"  {{'type': 'email', 'sender_email': 'my@email.com', ...,\n"
+            f"   'kindle_email': 'my_kindle@kindle.com'}},\n"
+            f"  {{'type': 'directory', 'path': '~/books'}}\n"
+            f"]}}"
+        )
+    try:
+        with open(cfg) as f:
+            config = json.load(f)
+    except json.JSONDecodeError:
+        raise click.ClickException(f"File '{cfg}' is not a valid JSON file.")
+
+    targets = []
+    for entry in config.get("targets", []):
+        entry = dict(entry)
+        target_type = entry.pop("type", None)
+        try:
+            if target_type == "kindle":
+                # Relative credential paths are resolved against the config dir.
+                config_path = cfg.parent / Path(entry["config"]).expanduser()
+                targets.append(KindleTarget(config_path, kindle_send))
+            elif target_type == "email":
+                targets.append(EmailTarget(Mailer(**entry)))
+            elif target_type == "directory":
+                targets.append(DirectoryTarget(Path(entry["path"]).expanduser()))
+            else:
+                raise click.ClickException(
+                    f"Unknown delivery target type: {target_type}"
+                )
+        except (KeyError, TypeError):
+            raise click.ClickException(f"Invalid {target_type} target in '{cfg}'.")
+
+    if not targets:
+        raise click.ClickException(f"No delivery targets configured in '{cfg}'.")
+
+    options = {
+        "max_workers": delivery_option(
+            config, "max_workers", DEFAULT_MAX_WORKERS, 1, cfg
+        ),
+        "retries": delivery_option(config, "retries", DEFAULT_RETRIES, 0, cfg),
+        "backoff": delivery_option(config, "backoff", DEFAULT_BACKOFF, 0, cfg),
+    }
+    return targets, options
+
+
+def delivery_option(
+    config: dict, name: str, default: Union[int, float], minimum: int, cfg: Path
+) -> Union[int, float]:
+    """Read numeric option from delivery config, converted to type of `default`."""
+    value = config.get(name, default)
+    try:
+        # Booleans are ints to Python, but not a number of workers or retries.
+        valid = not isinstance(value, bool)
+        value = type(default)(value)
+        # NaN is the only value not equal to itself.
+        valid = valid and value >= minimum and value == value
+    except (TypeError, ValueError):
+        valid = False
+    if not valid:
+        raise click.ClickException(
+            f"Invalid '{name}' in '{cfg}': expected a number of at least {minimum}."
+        )
+    return value
+
+
+def is_transient(error: BaseException) -> bool:
+    """Whether a failed send may succeed when retried.
+
+    Looks through wrapping exceptions, e.g. the ClickException raised for an
+    SMTP error, at the errors that caused them.
+    """
+    while error is not None:
+        if isinstance(error, TRANSIENT_ERRORS):
+            return True
+        # SMTP 4xx replies, e.g. 421 service not available, are temporary.
+        if isinstance(error, smtplib.SMTPResponseException):
+            return 400 <= error.smtp_code < 500
+        # So are rate limiting and server errors, e.g. from Send-to-Kindle.
+        if isinstance(error, urllib.error.HTTPError):
+            return error.code == 429 or error.code >= 500
+        if isinstance(error, urllib.error.URLError) and isinstance(
+            error.reason, BaseException
+        ):
+            error = error.reason
+        else:
+            error = error.__cause__
+    return False
+
+
+def send_with_retry(
+    target: Target,
+    filepath: Path,
+    author: str,
+    title: str,
+    format: str,
+    retries: int,
+    backoff: float,
+) -> DeliveryResult:
+    """Send file to a single target.
+
+    Transient network errors are retried with exponential backoff, other
+    errors fail the target straight away.
+    """
+    start = time.monotonic()
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(backoff * 2 ** (attempt - 1))
+        try:
+            target.send(filepath, author, title, format)
+            return DeliveryResult(
+                target.name, True, attempt + 1, time.monotonic() - start
+            )
+        except Exception as e:
+            if isinstance(e, click.ClickException):
+                error = e.format_message()
+            else:
+                error = str(e) or type(e).__name__
+            if not is_transient(e):
+                break
+    return DeliveryResult(
+        target.name, False, attempt + 1, time.monotonic() - start, error
+    )
+
+
+def deliver(
+    filepath: Path,
+    author: str,
+    title: str,
+    format: str,
+    targets: List[Target],
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    retries: int = DEFAULT_RETRIES,
+    backoff: float = DEFAULT_BACKOFF,
+) -> List[DeliveryResult]:
+    """Send file to all targets concurrently, at most `max_workers` at a time.
+
+    Returns one result per target, in the order of `targets`.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(targets)))) as pool:
+        futures = [
+            pool.submit(
+                send_with_retry,
+                target,
+                filepath,
+                author,
+                title,
+                format,
+                retries,
+                backoff,
+            )
+            for target in targets
+        ]
+        return [future.result() for future in futures]
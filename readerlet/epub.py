@@ -1,65 +1,143 @@
 import re
-import shutil
 from datetime import datetime
+from functools import lru_cache
+from io import TextIOWrapper
 from pathlib import Path
 from tempfile import TemporaryDirectory
+from typing import Union
 from uuid import uuid4
 from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
 
-from jinja2 import Environment, FileSystemLoader
+import click
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 
 from readerlet.article import Article
 
 
+TEMPLATES_DIR = Path(__file__).parent / "templates"
+DEFAULT_COMPRESSLEVEL = 6
+# Already compressed formats: deflating them costs CPU for no size gain.
+STORED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+
+
+def user_templates_dir() -> Path:
+    """Directory with user templates overriding the bundled ones by file name."""
+    return Path(click.get_app_dir("readerlet"), "templates")
+
+
+def template_cache_dir() -> Path:
+    """Directory for compiled template bytecode, used only if it exists."""
+    return Path(click.get_app_dir("readerlet"), "template_cache")
+
+
+@lru_cache(maxsize=None)
+def template_environment(
+    override_dir: Union[Path, None] = None, cache_dir: Union[Path, None] = None
+) -> Environment:
+    """Return Jinja environment shared by all EPUBs built in this process.
+
+    Compiled templates are kept in memory by the environment and, with
+    `cache_dir`, as bytecode on disk for later runs. Templates found in
+    `override_dir` take precedence over the bundled ones.
+    """
+    search_path = [TEMPLATES_DIR]
+    if override_dir is not None:
+        search_path.insert(0, override_dir)
+
+    return Environment(
+        loader=FileSystemLoader(search_path),
+        autoescape=True,
+        bytecode_cache=(
+            FileSystemBytecodeCache(str(cache_dir)) if cache_dir is not None else None
+        ),
+    )
+
+
+def get_environment() -> Environment:
+    override_dir = user_templates_dir()
+    cache_dir = template_cache_dir()
+    return template_environment(
+        override_dir if override_dir.is_dir() else None,
+        cache_dir if cache_dir.is_dir() else None,
+    )
+
+
+@lru_cache(maxsize=None)
+def static_asset(name: str) -> bytes:
+    """Read static template file once per process, preferring a user override."""
+    override = user_templates_dir() / name
+    if override.is_file():
+        return override.read_bytes()
+    return (TEMPLATES_DIR / name).read_bytes()
+
+
+def compress_type(name: str, store_media: bool = True) -> int:
+    """Return zip compression for archive entry based on its file type."""
+    if store_media and Path(name).suffix.lower() in STORED_EXTENSIONS:
+        return ZIP_STORED
+    return ZIP_DEFLATED
+
+
 def create_epub(
-    article: Article, output_path: str, remove_images: bool, for_kindle: bool
+    article: Article,
+    output_path: str,
+    remove_images: bool,
+    for_kindle: bool,
+    compresslevel: int = DEFAULT_COMPRESSLEVEL,
+    store_media: bool = True,
 ) -> Path:
-    env = Environment(
-        loader=FileSystemLoader(Path(__file__).parent / "templates"), autoescape=True
-    )
+    """Package article as EPUB in output_path.
+
+    Text entries are deflated at `compresslevel`. Images that are already
+    compressed are stored as-is unless `store_media` is False.
+    """
+    env = get_environment()
 
     with TemporaryDirectory() as temp_dir:
         temp_path = Path(temp_dir).resolve()
 
-        for dir_name in ["OEBPS", "META-INF", "OEBPS/images", "OEBPS/css"]:
-            (temp_path / dir_name).mkdir(parents=True, exist_ok=True)
+        (temp_path / "OEBPS/images").mkdir(parents=True)
 
         if not remove_images:
             article.extract_images(temp_path / "OEBPS/images", for_kindle)
 
-        shutil.copy(
-            Path(__file__).parent / "templates" / "container.xml",
-            temp_path / "META-INF" / "container.xml",
-        )
-
-        shutil.copy(
-            Path(__file__).parent / "templates" / "stylesheet.css",
-            temp_path / "OEBPS/css" / "stylesheet.css",
-        )
-
-        tmplt = env.get_template("content.xhtml")
-        content_xhtml = tmplt.render(article=article)
-        with (temp_path / "OEBPS" / "content.xhtml").open("w") as file:
-            file.write(content_xhtml)
-
-        tmplt = env.get_template("content.opf")
-        content_opf = tmplt.render(
-            article=article,
-            date=datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ"),
-            uuid=uuid4(),
-        )
-        with (temp_path / "OEBPS" / "content.opf").open("w") as file:
-            file.write(content_opf)
-
         epub_name = f"{clean_title(article.title)}.epub"
 
-        with ZipFile(Path(output_path) / epub_name, "w", ZIP_DEFLATED) as archive:
+        with ZipFile(
+            Path(output_path) / epub_name,
+            "w",
+            ZIP_DEFLATED,
+            compresslevel=compresslevel,
+        ) as archive:
             # Add mimetype file first, without compression as per epub3 specs.
             archive.writestr(
                 "mimetype", "application/epub+zip", compress_type=ZIP_STORED
             )
-            for file_path in temp_path.rglob("*"):
-                archive.write(file_path, arcname=file_path.relative_to(temp_path))
+            archive.writestr("META-INF/container.xml", static_asset("container.xml"))
+            archive.writestr("OEBPS/css/stylesheet.css", static_asset("stylesheet.css"))
+
+            # Render templates straight into the archive, chunk by chunk,
+            # rather than building the whole document as a string first.
+            tmplt = env.get_template("content.xhtml")
+            entry = archive.open("OEBPS/content.xhtml", "w")
+            with TextIOWrapper(entry, encoding="utf-8") as file:
+                tmplt.stream(article=article).dump(file)
+
+            tmplt = env.get_template("content.opf")
+            entry = archive.open("OEBPS/content.opf", "w")
+            with TextIOWrapper(entry, encoding="utf-8") as file:
+                tmplt.stream(
+                    article=article,
+                    date=datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ"),
+                    uuid=uuid4(),
+                ).dump(file)
+
+            for file_path in sorted((temp_path / "OEBPS/images").iterdir()):
+                archive.write(
+                    file_path,
+                    arcname=file_path.relative_to(temp_path),
+                    compress_type=compress_type(file_path.name, store_media),
+                )
 
     return Path(output_path) / epub_name
 
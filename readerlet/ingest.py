@@ -0,0 +1,191 @@
+import codecs
+import hashlib
+import sqlite3
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Union
+from urllib.parse import urljoin
+
+import click
+import requests
+from bs4 import BeautifulSoup
+
+ATOM_NS = "{http://www.w3.org/2005/Atom}"
+RSS1_NS = "{http://purl.org/rss/1.0/}"
+BOOKMARKS_DOCTYPE = "<!doctype netscape-bookmark-file-1>"
+
+
+class StateStore:
+    """SQLite record of processed URLs and their content hashes."""
+
+    def __init__(self, db_path: Path):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS processed "
+            "(url TEXT PRIMARY KEY, content_hash TEXT, processed_at TEXT, "
+            "min_length INTEGER, max_link_density REAL)"
+        )
+        # Databases created before rejections kept their limits.
+        columns = [
+            row[1] for row in self.connection.execute("PRAGMA table_info(processed)")
+        ]
+        for column, column_type in [
+            ("min_length", "INTEGER"),
+            ("max_link_density", "REAL"),
+        ]:
+            if column not in columns:
+                self.connection.execute(
+                    f"ALTER TABLE processed ADD COLUMN {column} {column_type}"
+                )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS processed_hash ON processed (content_hash)"
+        )
+        self.connection.commit()
+
+    def __enter__(self) -> "StateStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.connection.close()
+
+    def is_processed(
+        self, url: str, min_length: int = 0, max_link_density: float = 1.0
+    ) -> bool:
+        """Whether URL was handled before and should not be processed again.
+
+        URLs rejected by the quality limits count as processed only while the
+        given limits are at least as strict as the ones that rejected them.
+        """
+        row = self.connection.execute(
+            "SELECT min_length, max_link_density FROM processed WHERE url = ?",
+            (url,),
+        ).fetchone()
+        if row is None:
+            return False
+        rejected_min_length, rejected_max_link_density = row
+        if rejected_min_length is None:
+            return True
+        return (
+            min_length >= rejected_min_length
+            and max_link_density <= rejected_max_link_density
+        )
+
+    def has_hash(self, content_hash: str) -> bool:
+        row = self.connection.execute(
+            "SELECT 1 FROM processed WHERE content_hash = ?", (content_hash,)
+        ).fetchone()
+        return row is not None
+
+    def record(
+        self,
+        url: str,
+        content_hash: Union[str, None] = None,
+        min_length: Union[int, None] = None,
+        max_link_density: Union[float, None] = None,
+    ) -> None:
+        """Record URL as processed.
+
+        For articles rejected by the quality limits, pass the limits so that
+        the URL is retried if they are relaxed later.
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO processed "
+            "(url, content_hash, processed_at, min_length, max_link_density) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (
+                url,
+                content_hash,
+                datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                min_length,
+                max_link_density,
+            ),
+        )
+        self.connection.commit()
+
+
+def default_state_path() -> Path:
+    return Path(click.get_app_dir("readerlet"), "state.db")
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def parse_feed(xml: Union[str, bytes], base_url: str = "") -> List[str]:
+    """Return item links from an RSS 2.0, RSS 1.0 or Atom feed."""
+    root = ET.fromstring(xml)
+    links = []
+
+    # RSS 2.0: <rss><channel><item><link>url</link></item>.
+    # RSS 1.0: <rdf:RDF><item><link>url</link></item>.
+    for item in root.iter("item"):
+        link = item.findtext("link")
+        if link and link.strip():
+            links.append(link.strip())
+    for item in root.iter(f"{RSS1_NS}item"):
+        link = item.findtext(f"{RSS1_NS}link")
+        if link and link.strip():
+            links.append(link.strip())
+
+    # Atom: <feed><entry><link rel="alternate" href="url"/></entry>.
+    for entry in root.iter(f"{ATOM_NS}entry"):
+        for link in entry.findall(f"{ATOM_NS}link"):
+            if link.get("rel", "alternate") == "alternate" and link.get("href"):
+                links.append(urljoin(base_url, link.get("href")))
+                break
+
+    return dedupe(links)
+
+
+def parse_link_list(text: str, base_url: str = "") -> List[str]:
+    """Return URLs from an HTML bookmarks export or a plain list, one per line.
+
+    Other HTML, such as an ordinary web page, is rejected rather than having
+    its navigation links taken for articles.
+    """
+    head = text.lstrip()[: len(BOOKMARKS_DOCTYPE)].lower()
+    if head == BOOKMARKS_DOCTYPE:
+        soup = BeautifulSoup(text, "html.parser")
+        links = [urljoin(base_url, a["href"]) for a in soup.find_all("a", href=True)]
+    elif head.startswith("<"):
+        raise click.ClickException("Not a feed or link list.")
+    else:
+        links = [line.strip() for line in text.splitlines()]
+
+    return dedupe([link for link in links if link.startswith(("http://", "https://"))])
+
+
+def load_source(source: str) -> List[str]:
+    """Load article URLs from a feed or link list, given as a URL or local file."""
+    response = None
+    if Path(source).is_file():
+        data = Path(source).read_bytes()
+        base_url = ""
+    else:
+        try:
+            response = requests.get(source, timeout=10)
+            response.raise_for_status()
+        except requests.exceptions.RequestException:
+            raise click.ClickException(f"Failed to fetch: {source}")
+        data = response.content
+        base_url = source
+
+    # Feeds are parsed from bytes, so that their XML declaration picks the
+    # encoding rather than the HTTP headers.
+    data = data.lstrip()
+    if data.startswith(codecs.BOM_UTF8):
+        data = data[len(codecs.BOM_UTF8) :].lstrip()
+    if data.startswith((b"<?xml", b"<rss", b"<feed", b"<rdf")):
+        try:
+            return parse_feed(data, base_url)
+        except ET.ParseError:
+            raise click.ClickException(f"Failed to parse feed: {source}")
+
+    text = response.text if response is not None else data.decode("utf-8")
+    return parse_link_list(text.lstrip("\ufeff"), base_url)
+
+
+def dedupe(links: List[str]) -> List[str]:
+    return list(dict.fromkeys(links))
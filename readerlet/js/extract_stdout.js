@@ -1,12 +1,67 @@
-const { Readability } = require("@mozilla/readability");
+const { Readability, isProbablyReaderable } = require("@mozilla/readability");
 const { JSDOM } = require("jsdom");
 
-// Usage: node extract_stdout.js <URL>
+// Usage: node extract_stdout.js <URL> [--option[=value] ...] [field ...]
+//
+// Writes the requested fields of the Readability result to stdout as a
+// sequence of frames: an ASCII header line "<field> <byte length>\n"
+// followed by exactly that many bytes of UTF-8 payload. Fields that are
+// null or missing are omitted. Without field arguments all fields are sent.
+//
+// Options:
+//   --precheck    Skip pages failing isProbablyReaderable and write a
+//                 single "rejected" frame instead.
 
-function extractContent(page) {
-  const reader = new Readability(page.window.document);
+const FIELDS = [
+  "title",
+  "byline",
+  "lang",
+  "content",
+  "textContent",
+  "length",
+  "linkDensity",
+];
+
+function writeFrame(name, value) {
+  if (value === null || value === undefined) {
+    return;
+  }
+  const payload = Buffer.from(String(value), "utf8");
+  process.stdout.write(`${name} ${payload.length}\n`);
+  process.stdout.write(payload);
+}
+
+function linkDensity(html, textLength) {
+  const document = new JSDOM(html).window.document;
+  let linkLength = 0;
+  for (const link of document.querySelectorAll("a")) {
+    linkLength += link.textContent.trim().length;
+  }
+  return textLength ? linkLength / textLength : 0;
+}
+
+function extractContent(page, fields, options) {
+  const document = page.window.document;
+
+  if (options.precheck) {
+    if (!isProbablyReaderable(document)) {
+      writeFrame("rejected", "not readerable");
+      process.stdout.write("", process.exit);
+      return;
+    }
+  }
+
+  const reader = new Readability(document);
   const content = reader.parse();
-  process.stdout.write(JSON.stringify(content), process.exit);
+  if (content) {
+    if (fields.includes("linkDensity")) {
+      content.linkDensity = linkDensity(content.content, content.length);
+    }
+    for (const field of fields) {
+      writeFrame(field, content[field]);
+    }
+  }
+  process.stdout.write("", process.exit);
 }
 
 if (!process.argv[2]) {
@@ -15,7 +70,26 @@ if (!process.argv[2]) {
 }
 
 const url = process.argv[2];
+const options = {};
+const requested = [];
+
+for (const arg of process.argv.slice(3)) {
+  if (arg.startsWith("--")) {
+    const [name, value] = arg.slice(2).split("=");
+    options[name] = value === undefined ? true : value;
+  } else {
+    requested.push(arg);
+  }
+}
+
+const fields = requested.length ? requested : FIELDS;
+
+const unknown = fields.filter((field) => !FIELDS.includes(field));
+if (unknown.length) {
+  console.error(`Error: Unknown field(s): ${unknown.join(", ")}.`);
+  process.exit(1);
+}
 
 JSDOM.fromURL(url).then((page) => {
-  extractContent(page);
+  extractContent(page, fields, options);
 });
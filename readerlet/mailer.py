@@ -50,7 +50,7 @@ class Mailer:
                 connection.sendmail(self.sender_email, self.kindle_email, email_str)
                 connection.quit()
         except smtplib.SMTPException as e:
-            raise click.ClickException("Error whilst sending email:", e)
+            raise click.ClickException(f"Error whilst sending email: {e}") from e
 
 
 def send_via_email(attachment_path: Path) -> None:
@@ -0,0 +1,33 @@
+from unittest.mock import patch
+
+import pytest
+
+from readerlet.epub import static_asset, template_environment
+
+
+def pytest_addoption(parser):
+    parser.addoption("--benchmark", action="store_true", help="Run timing benchmarks.")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--benchmark"):
+        return
+    skip = pytest.mark.skip(reason="timing benchmark, use --benchmark to run")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture(autouse=True)
+def template_dirs(tmp_path):
+    """Keep tests away from the user's template overrides and cache."""
+    override_dir = tmp_path / "templates"
+    cache_dir = tmp_path / "template_cache"
+    with patch("readerlet.epub.user_templates_dir", return_value=override_dir), patch(
+        "readerlet.epub.template_cache_dir", return_value=cache_dir
+    ):
+        template_environment.cache_clear()
+        static_asset.cache_clear()
+        yield override_dir, cache_dir
+    template_environment.cache_clear()
+    static_asset.cache_clear()
@@ -1,12 +1,25 @@
-import subprocess
+import base64
+import io
+import os
+import struct
+import tracemalloc
+import zlib
+from html.parser import HTMLParser
 from unittest.mock import patch
 
 import click
 import pytest
+import requests
 from bs4 import BeautifulSoup
+from PIL import Image
 
-from readerlet.article import Article
-from readerlet.cli import extract_content
+from readerlet.article import Article, ParagraphParser
+from readerlet.cli import (
+    ContentRejected,
+    PageNotReaderable,
+    extract_content,
+    read_frames,
+)
 
 
 @pytest.fixture
@@ -21,37 +34,168 @@ def article():
     )
 
 
+def frames(**fields):
+    data = b""
+    for name, value in fields.items():
+        payload = value.encode("utf-8")
+        data += f"{name} {len(payload)}\n".encode("ascii") + payload
+    return data
+
+
 @pytest.fixture
-def mock_subprocess_run():
-    with patch("subprocess.run") as mock_sub_run:
-        yield mock_sub_run
+def mock_subprocess_popen():
+    with patch("subprocess.Popen") as mock_popen:
+        mock_popen.return_value.__enter__.return_value.returncode = 0
+        yield mock_popen
+
+
+def test_read_frames():
+    stream = io.BytesIO(frames(title="Tëst", content="<p>" + "ü" * 100_000 + "</p>"))
+    result = read_frames(stream)
+    assert result == {"title": "Tëst", "content": "<p>" + "ü" * 100_000 + "</p>"}
+
 
+def test_read_frames_truncated():
+    stream = io.BytesIO(b"content 10\n<p>")
+    with pytest.raises(ValueError, match="Truncated frame"):
+        read_frames(stream)
 
-def test_extract_content_successful_extraction(mock_subprocess_run):
-    mock_subprocess_run.return_value.stdout = '{"title": "Sample Title", "byline": "Author", "lang": "en", "content": "<p>Content</p>", "textContent": "Text Content"}'
+
+def test_extract_content_successful_extraction(mock_subprocess_popen):
+    mock_subprocess_popen.return_value.__enter__.return_value.stdout = io.BytesIO(
+        frames(
+            title="Sample Title",
+            byline="Author",
+            lang="en",
+            content="<p>Content</p>",
+            textContent="Text Content",
+        )
+    )
     url = "http://example.com"
     result = extract_content(url)
     assert isinstance(result, Article)
     assert result.url == url
     assert result.title == "Sample Title"
+    assert result.text_content == "Text Content"
 
 
-def test_extract_content_unsuccessful_extraction(mock_subprocess_run):
-    mock_subprocess_run.side_effect = subprocess.CalledProcessError(
-        returncode=1, cmd="node"
+def test_extract_content_requests_only_selected_fields(mock_subprocess_popen):
+    mock_subprocess_popen.return_value.__enter__.return_value.stdout = io.BytesIO(
+        frames(title="Sample Title", textContent="Text  Content")
     )
     url = "http://example.com"
+    result = extract_content(url, fields=("textContent",))
+    args = mock_subprocess_popen.call_args[0][0]
+    assert args[-4:] == ["title", "byline", "lang", "textContent"]
+    assert result.byline == "example.com"
+    assert result.content == ""
+    assert result.text_content == "Text  Content"
+
+
+def test_extract_content_unsuccessful_extraction(mock_subprocess_popen):
+    mock_subprocess_popen.return_value.__enter__.return_value.stdout = io.BytesIO(b"")
+    mock_subprocess_popen.return_value.__enter__.return_value.returncode = 1
+    url = "http://example.com"
     with pytest.raises(click.ClickException, match="Failed to extract article."):
         extract_content(url)
 
 
-def test_extract_content_no_content(mock_subprocess_run):
-    mock_subprocess_run.return_value.stdout = '{"title": "Sample Title", "byline": "Author", "lang": "en", "content": "", "textContent": "Text Content"}'
+def test_extract_content_no_content(mock_subprocess_popen):
+    mock_subprocess_popen.return_value.__enter__.return_value.stdout = io.BytesIO(
+        frames(title="Sample Title", byline="Author", lang="en", content="")
+    )
     url = "http://example.com"
     with pytest.raises(click.ClickException, match="Content not extracted."):
         extract_content(url)
 
 
+def test_extract_content_precheck_rejected(mock_subprocess_popen):
+    readability = mock_subprocess_popen.return_value.__enter__.return_value
+    readability.stdout = io.BytesIO(frames(rejected="not readerable"))
+    with pytest.raises(PageNotReaderable, match="Page does not look like an article."):
+        extract_content("http://example.com", precheck=True)
+    assert "--precheck" in mock_subprocess_popen.call_args[0][0]
+
+
+def test_extract_content_min_length(mock_subprocess_popen):
+    readability = mock_subprocess_popen.return_value.__enter__.return_value
+    readability.stdout = io.BytesIO(
+        frames(title="Title", content="<p>Short</p>", length="5")
+    )
+    with pytest.raises(ContentRejected, match="Content too short: 5 characters."):
+        extract_content("http://example.com", fields=("content",), min_length=100)
+    assert mock_subprocess_popen.call_args[0][0][-1] == "length"
+
+
+def test_extract_content_max_link_density(mock_subprocess_popen):
+    readability = mock_subprocess_popen.return_value.__enter__.return_value
+    readability.stdout = io.BytesIO(
+        frames(title="Title", content="<p><a>Links</a></p>", linkDensity="0.8")
+    )
+    with pytest.raises(ContentRejected, match="Content is mostly links: 80%."):
+        extract_content("http://example.com", fields=("content",), max_link_density=0.5)
+
+    readability.stdout = io.BytesIO(
+        frames(title="Title", content="<p><a>Links</a></p>", linkDensity="0.2")
+    )
+    article = extract_content(
+        "http://example.com", fields=("content",), max_link_density=0.5
+    )
+    assert article.content == "<p><a>Links</a></p>"
+
+
+def test_iter_text_normalises_whitespace(article):
+    article.text_content = "  Test\n\ntext \t only   content "
+    assert "".join(article.iter_text()) == "Test text only content"
+
+
+def test_iter_html_chunks(article):
+    article.content = "<p>" + "x" * 200_000 + "</p>"
+    chunks = list(article.iter_html())
+    assert len(chunks) == 4
+    assert max(len(chunk) for chunk in chunks) == 64 * 1024
+    assert "".join(chunks) == article.content
+
+
+def test_iter_text_chunks(article):
+    article.text_content = " ".join(["word"] * 10_000)
+    chunks = list(article.iter_text())
+    assert len(chunks) == 3
+    assert "".join(chunks) == article.text_content
+
+
+def test_iter_text_paragraphs(article):
+    article.content = "<h2>Heading</h2><p>First\n   paragraph</p><div><p>Second</p></div><p>Third <b>bold</b></p>"
+    assert (
+        "".join(article.iter_text(paragraphs=True))
+        == "Heading\n\nFirst paragraph\n\nSecond\n\nThird bold"
+    )
+
+
+def test_iter_paragraphs_inline_separators(article):
+    article.content = (
+        "<p>Line one<br>Line two</p>"
+        "<table><tr><th>head</th><th>er</th></tr><tr><td>cell</td><td>next</td></tr>"
+        "</table>"
+    )
+    assert list(article.iter_paragraphs()) == [
+        "Line one Line two",
+        "head er",
+        "cell next",
+    ]
+
+
+def test_iter_paragraphs_streams(article):
+    article.content = "<p>First</p>" + "<p>Filler paragraph</p>" * 20_000
+    with patch.object(ParagraphParser, "feed", autospec=True) as mock_feed:
+        mock_feed.side_effect = HTMLParser.feed
+        paragraphs = article.iter_paragraphs()
+        assert next(paragraphs) == "First"
+        # Only the first chunk of the content has been parsed.
+        assert mock_feed.call_count == 1
+        assert len(list(paragraphs)) == 20_000
+
+
 def test_remove_hyperlinks_href(article):
     article.remove_hyperlinks()
     soup = BeautifulSoup(article.content, "html.parser")
@@ -59,6 +203,40 @@ def test_remove_hyperlinks_href(article):
     assert not soup.find("a").has_attr("href")
 
 
+def test_remove_hyperlinks_keeps_data_uri_out_of_dom(article):
+    encoded = base64.b64encode(os.urandom(6 * 1024 * 1024)).decode()
+    article.content = (
+        '<p><a href="/more">Text</a></p>' * 1000
+        + f'<img src="data:image/png;base64,{encoded}">'
+    )
+    input_size = len(article.content)
+
+    tracemalloc.start()
+    try:
+        article.remove_hyperlinks()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # Only the restored content is built at full size, not a parsed copy.
+    assert peak < 3 * input_size
+    assert "<a>Text</a>" in article.content
+    assert article.content.endswith(f'<img src="data:image/png;base64,{encoded}"/>')
+
+
+def test_remove_hyperlinks_keeps_placeholder_like_text(article):
+    pixel = base64.b64encode(image_bytes("GIF", (1, 1))).decode()
+    article.content = (
+        f'<img src="data:image/gif;base64,{pixel}">'
+        '<p><a href="/x">text readerlet-data-uri-0- here</a></p>'
+    )
+    article.remove_hyperlinks()
+    assert article.content == (
+        f'<img src="data:image/gif;base64,{pixel}"/>'
+        "<p><a>text readerlet-data-uri-0- here</a></p>"
+    )
+
+
 def test_remove_images(article):
     article.remove_images()
     soup = BeautifulSoup(article.content, "html.parser")
@@ -67,6 +245,7 @@ def test_remove_images(article):
 
 
 def test_extract_images(article, tmp_path):
+    (tmp_path / "test-image.jpg").write_bytes(b"jpg")
     with patch.object(
         Article, "download_image", return_value=(tmp_path / "test-image.jpg", "jpg")
     ):
@@ -78,8 +257,9 @@ def test_extract_images(article, tmp_path):
 
 
 def test_extract_images_with_base64(article, tmp_path):
+    (tmp_path / "test-base64.png").write_bytes(b"png")
     with patch.object(
-        Article, "download_image", return_value=(tmp_path / "test-base64.png", "png")
+        Article, "save_data_uri", return_value=(tmp_path / "test-base64.png", "png")
     ):
         article.content = (
             '<img src="data:image/png;base64,base64data" alt="Test Image base64">'
@@ -93,6 +273,7 @@ def test_extract_images_with_base64(article, tmp_path):
 
 
 def test_extract_images_check_content_type_header(article, tmp_path):
+    (tmp_path / "test-content-type.jpg").write_bytes(b"jpg")
     with patch.object(
         Article,
         "download_image",
@@ -132,6 +313,7 @@ def article_webp():
 def test_extract_images_webp_conversion(article_webp, tmp_path):
     webp_image_path = tmp_path / "test-image.webp"
     png_image_path = tmp_path / "test-image.png"
+    png_image_path.write_bytes(b"png")
 
     with patch.object(
         Article, "download_image", return_value=(webp_image_path, "webp")
@@ -148,6 +330,7 @@ def test_extract_images_webp_conversion(article_webp, tmp_path):
 def test_extract_images_no_webp_conversion(article_webp, tmp_path):
     webp_image_path = tmp_path / "test-image.webp"
     png_image_path = tmp_path / "test-image.png"
+    webp_image_path.write_bytes(b"webp")
 
     with patch.object(
         Article, "download_image", return_value=(webp_image_path, "webp")
@@ -159,3 +342,297 @@ def test_extract_images_no_webp_conversion(article_webp, tmp_path):
     assert article_webp.images[0][0] == "test-image.webp"
     assert article_webp.images[0][1] == "image/webp"
     assert "images/test-image.webp" in article_webp.content
+
+
+def test_extract_images_same_url_downloaded_once(article, tmp_path):
+    (tmp_path / "test-image.jpg").write_bytes(b"jpg")
+    article.content = (
+        "<img src='https://example.com/test-image.jpg'><img src='/test-image.jpg'>"
+    )
+    with patch.object(
+        Article, "download_image", return_value=(tmp_path / "test-image.jpg", "jpg")
+    ) as mock_download:
+        article.extract_images(tmp_path, for_kindle=False)
+
+    assert mock_download.call_count == 1
+    assert article.images == [("test-image.jpg", "image/jpeg")]
+    assert article.content.count('src="images/test-image.jpg"') == 2
+
+
+def test_extract_images_query_variant_deduplicated_by_content(article, tmp_path):
+    (tmp_path / "test-image.jpg").write_bytes(b"jpg")
+    (tmp_path / "test-image-1.jpg").write_bytes(b"jpg")
+    article.content = (
+        "<img src='http://example.com/test-image.jpg'>"
+        "<img src='/test-image.jpg?size=large'>"
+    )
+    with patch.object(
+        Article,
+        "download_image",
+        side_effect=[
+            (tmp_path / "test-image.jpg", "jpg"),
+            (tmp_path / "test-image-1.jpg", "jpg"),
+        ],
+    ) as mock_download:
+        article.extract_images(tmp_path, for_kindle=False)
+
+    # Different URLs are both fetched, identical bytes are stored once.
+    assert mock_download.call_count == 2
+    assert article.images == [("test-image.jpg", "image/jpeg")]
+    assert article.content.count('src="images/test-image.jpg"') == 2
+    assert not (tmp_path / "test-image-1.jpg").exists()
+
+
+def test_extract_images_keeps_encoded_query(article, tmp_path):
+    (tmp_path / "image.jpg").write_bytes(b"jpg")
+    src = "/_next/image?url=https%3A%2F%2Fcdn%2Fa.jpg%3Fw%3D100%26q%3D5&w=1080"
+    article.content = f'<img src="{src}">'
+    with patch.object(
+        Article, "download_image", return_value=(tmp_path / "image.jpg", "jpg")
+    ) as mock_download:
+        article.extract_images(tmp_path, for_kindle=False)
+
+    mock_download.assert_called_once_with("https://example.com" + src, tmp_path)
+
+
+def test_extract_images_identical_content_stored_once(article, tmp_path):
+    (tmp_path / "a.jpg").write_bytes(b"same bytes")
+    (tmp_path / "b.jpg").write_bytes(b"same bytes")
+    article.content = (
+        "<img src='https://cdn1.example.com/a.jpg'>"
+        "<img src='https://cdn2.example.com/b.jpg'>"
+    )
+    with patch.object(
+        Article,
+        "download_image",
+        side_effect=[(tmp_path / "a.jpg", "jpg"), (tmp_path / "b.jpg", "jpg")],
+    ):
+        article.extract_images(tmp_path, for_kindle=False)
+
+    assert article.images == [("a.jpg", "image/jpeg")]
+    assert article.content.count('src="images/a.jpg"') == 2
+    assert not (tmp_path / "b.jpg").exists()
+
+
+def test_download_image_same_name_not_overwritten(tmp_path):
+    (tmp_path / "image.jpg").write_bytes(b"first")
+    with patch("requests.get") as mock_get:
+        mock_get.return_value.headers = {}
+        mock_get.return_value.iter_content.return_value = [b"second"]
+        image_path, extension = Article.download_image(
+            "https://example.com/other/image.jpg", tmp_path
+        )
+
+    assert extension == "jpg"
+    assert image_path != tmp_path / "image.jpg"
+    assert image_path.read_bytes() == b"second"
+    assert (tmp_path / "image.jpg").read_bytes() == b"first"
+
+
+def test_parse_srcset():
+    srcset = "small.jpg 480w, https://cdn.example.com/w_800,h_600/m.jpg 800w,large.jpg"
+    assert Article.parse_srcset(srcset) == [
+        ("small.jpg", "480w"),
+        ("https://cdn.example.com/w_800,h_600/m.jpg", "800w"),
+        ("large.jpg", ""),
+    ]
+
+
+def select(html, target_width=1200):
+    img_tag = BeautifulSoup(html, "html.parser").find("img")
+    return Article.select_image_source(img_tag, target_width)
+
+
+def test_select_image_source_width_descriptors():
+    html = "<img src='orig.jpg' srcset='s.jpg 600w, m.jpg 1280w, l.jpg 2400w'>"
+    assert select(html) == "m.jpg"
+    assert select(html, target_width=3000) == "l.jpg"
+
+
+def test_select_image_source_density_descriptors():
+    html = "<img src='a.jpg' width='400' srcset='a.jpg 1x, b.jpg 2x, c.jpg 4x'>"
+    assert select(html) == "c.jpg"
+    assert select(html, target_width=800) == "b.jpg"
+
+
+def test_select_image_source_lazy_loaded():
+    html = "<img src='data:image/gif;base64,R0lGOD' data-src='real.jpg'>"
+    assert select(html) == "real.jpg"
+    html = "<img src='placeholder.gif' data-srcset='a.jpg 300w, b.jpg 1500w'>"
+    assert select(html) == "b.jpg"
+
+
+def test_select_image_source_skips_placeholder_srcset():
+    pixel = base64.b64encode(image_bytes("GIF", (1, 1))).decode()
+    html = (
+        f"<img srcset='data:image/gif;base64,{pixel}' "
+        "data-srcset='a.jpg 320w, b.jpg 480w'>"
+    )
+    assert select(html) == "b.jpg"
+
+
+def test_select_image_source_picture():
+    html = (
+        "<picture>"
+        "<source type='image/avif' srcset='big.avif 1600w'>"
+        "<source type='image/webp' srcset='small.webp 400w, big.webp 1600w'>"
+        "<img src='fallback.jpg'>"
+        "</picture>"
+    )
+    assert select(html) == "big.webp"
+
+
+def test_extract_images_picture_unwrapped(article, tmp_path):
+    (tmp_path / "big.jpg").write_bytes(b"jpg")
+    article.content = (
+        "<figure><picture><source srcset='/small.jpg 400w, /big.jpg 1600w'>"
+        "<img src='/fallback.jpg' srcset='/fallback.jpg 800w' sizes='50vw'>"
+        "</picture></figure>"
+    )
+    with patch.object(
+        Article, "download_image", return_value=(tmp_path / "big.jpg", "jpg")
+    ) as mock_download:
+        article.extract_images(tmp_path, for_kindle=False)
+
+    mock_download.assert_called_once_with("https://example.com/big.jpg", tmp_path)
+    assert article.content == '<figure><img src="images/big.jpg"/></figure>'
+
+
+def image_bytes(format, size=(40, 30)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size).save(buffer, format=format)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def mock_get():
+    with patch("requests.get") as mock_get:
+        mock_get.return_value.headers = {}
+        yield mock_get
+
+
+def test_sniff_image():
+    assert Article.sniff_image(image_bytes("JPEG")) == ("jpg", (40, 30))
+    assert Article.sniff_image(image_bytes("PNG")[:64]) == ("png", (40, 30))
+    assert Article.sniff_image(b'<?xml version="1.0"?><svg></svg>') == ("svg", None)
+    assert Article.sniff_image(b"<!DOCTYPE html><html>") == (None, None)
+
+
+def test_download_image_extension_from_content(mock_get, tmp_path):
+    mock_get.return_value.iter_content.return_value = [image_bytes("WEBP")]
+    image_path, extension = Article.download_image(
+        "https://example.com/photo.jpg", tmp_path
+    )
+    assert extension == "webp"
+    assert image_path == tmp_path / "photo.webp"
+
+
+def test_download_image_rejects_tracking_pixel(mock_get, tmp_path):
+    mock_get.return_value.iter_content.return_value = [image_bytes("GIF", (1, 1))]
+    assert Article.download_image("https://example.com/pixel.gif", tmp_path) is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_download_image_rejects_html(mock_get, tmp_path):
+    mock_get.return_value.iter_content.return_value = [b"<!DOCTYPE html><html>"]
+    assert Article.download_image("https://example.com/image.jpg", tmp_path) is None
+
+
+def test_download_image_rejects_large_content_length(mock_get, tmp_path):
+    mock_get.return_value.headers = {"Content-Length": "2048"}
+    mock_get.return_value.iter_content.return_value = [image_bytes("PNG")]
+    assert (
+        Article.download_image("https://example.com/a.png", tmp_path, max_bytes=1024)
+        is None
+    )
+    assert not mock_get.return_value.iter_content.called
+
+
+def test_download_image_stops_at_max_bytes(mock_get, tmp_path):
+    mock_get.return_value.iter_content.return_value = [image_bytes("PNG")] + [
+        b"\x00" * 1024
+    ] * 10
+    assert (
+        Article.download_image("https://example.com/a.png", tmp_path, max_bytes=4096)
+        is None
+    )
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_save_data_uri(tmp_path):
+    data = bytes(range(256)) * 1000
+    encoded = base64.b64encode(data).decode()
+    # Line breaks inside the payload must not break chunk alignment.
+    encoded = "\n".join(encoded[i : i + 76] for i in range(0, len(encoded), 76))
+    html = f'<img src="data:image/svg+xml;base64,{encoded}">'
+    start = html.index("data:")
+    end = html.index('">')
+
+    image_path, extension = Article.save_data_uri(html, start, end, tmp_path)
+    assert extension == "svg"
+    assert image_path.read_bytes() == data
+
+
+def test_save_data_uri_rejects_tracking_pixel(tmp_path):
+    uri = (
+        "data:image/gif;base64," + base64.b64encode(image_bytes("GIF", (1, 1))).decode()
+    )
+    assert Article.save_data_uri(uri, 0, len(uri), tmp_path) is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_save_data_uri_invalid(tmp_path):
+    uri = "data:image/png;base64,abc"
+    assert Article.save_data_uri(uri, 0, len(uri), tmp_path) is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_extract_images_data_uri_not_parsed_into_dom(article, tmp_path):
+    data = base64.b64encode(b"png bytes").decode()
+    article.content = (
+        f'<p>Inline</p><img src="data:image/png;base64,{data}">'
+        f"<code>src='data:image/png;base64,{data}'</code>"
+    )
+    with patch.object(Article, "download_image") as mock_download:
+        article.extract_images(tmp_path, for_kindle=False)
+
+    assert not mock_download.called
+    ((image_name, mimetype),) = article.images
+    assert mimetype == "image/png"
+    assert (tmp_path / image_name).read_bytes() == b"png bytes"
+    assert article.content == (
+        f'<p>Inline</p><img src="images/{image_name}"/>'
+        f"<code>src='data:image/png;base64,{data}'</code>"
+    )
+
+
+def test_download_image_name_from_decoded_path(mock_get, tmp_path):
+    mock_get.return_value.iter_content.return_value = [b"image"]
+    image_path, extension = Article.download_image(
+        "https://example.com/my%20image.jpg?w=100%26h%3D5", tmp_path
+    )
+    assert image_path == tmp_path / "my image.jpg"
+    assert extension == "jpg"
+
+
+def png_with_size(width, height):
+    # A tiny real PNG whose IHDR claims the given dimensions.
+    data = bytearray(image_bytes("PNG", (1, 1)))
+    ihdr = b"IHDR" + struct.pack(">II", width, height) + data[24:29]
+    data[12:29] = ihdr
+    data[29:33] = struct.pack(">I", zlib.crc32(ihdr))
+    return bytes(data)
+
+
+@pytest.mark.parametrize("size", [(8000, 6000), (20000, 10000)])
+def test_download_image_rejects_oversized(mock_get, tmp_path, size):
+    mock_get.return_value.iter_content.return_value = [png_with_size(*size)]
+    assert Article.download_image("https://example.com/huge.png", tmp_path) is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_download_image_http_error_releases_connection(mock_get, tmp_path):
+    response = mock_get.return_value
+    response.raise_for_status.side_effect = requests.exceptions.HTTPError("404")
+    assert Article.download_image("https://example.com/a.png", tmp_path) is None
+    response.__exit__.assert_called_once()
@@ -0,0 +1,249 @@
+import json
+import smtplib
+import socket
+import threading
+import time
+import urllib.error
+from unittest.mock import MagicMock, patch
+
+import click
+import pytest
+from click.testing import CliRunner
+from stkclient.api import APIError
+
+from readerlet.cli import cli, kindle_send
+from readerlet.delivery import (
+    DirectoryTarget,
+    EmailTarget,
+    KindleTarget,
+    deliver,
+    is_transient,
+    load_targets,
+)
+
+
+class FakeTarget:
+    def __init__(self, name, delay=0.0, failures=0, error=ConnectionError):
+        self.name = name
+        self.delay = delay
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def send(self, filepath, author, title, format):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        if self.calls <= self.failures:
+            raise self.error(f"{self.name} unavailable")
+
+
+@pytest.fixture
+def epub_file(tmp_path):
+    epub = tmp_path / "Test-title.epub"
+    epub.write_bytes(b"epub")
+    return epub
+
+
+def test_load_targets(tmp_path):
+    cfg = tmp_path / "delivery_config.json"
+    cfg.write_text(
+        json.dumps(
+            {
+                "max_workers": 2,
+                "targets": [
+                    {"type": "kindle", "config": "second_account.json"},
+                    {
+                        "type": "email",
+                        "sender_email": "me@example.com",
+                        "sender_password": "password",
+                        "smtp_server": "smtp.example.com",
+                        "smtp_port": 465,
+                        "kindle_email": "me@kindle.com",
+                    },
+                    {"type": "directory", "path": str(tmp_path / "books")},
+                ],
+            }
+        )
+    )
+    kindle_send = MagicMock()
+
+    targets, options = load_targets(cfg, kindle_send)
+
+    assert [type(t) for t in targets] == [KindleTarget, EmailTarget, DirectoryTarget]
+    assert targets[0].config_path == tmp_path / "second_account.json"
+    assert targets[1].name == "email:me@kindle.com"
+    assert options == {"max_workers": 2, "retries": 2, "backoff": 1.0}
+
+    targets[0].send(tmp_path / "book.epub", "Author", "Title", "EPUB")
+    kindle_send.assert_called_once_with(
+        tmp_path / "book.epub",
+        "Author",
+        "Title",
+        "EPUB",
+        config_path=tmp_path / "second_account.json",
+    )
+
+
+def test_load_targets_unknown_type(tmp_path):
+    cfg = tmp_path / "delivery_config.json"
+    cfg.write_text(json.dumps({"targets": [{"type": "fax"}]}))
+    with pytest.raises(click.ClickException, match="Unknown delivery target type"):
+        load_targets(cfg, MagicMock())
+
+
+def test_load_targets_missing_config(tmp_path):
+    with pytest.raises(click.ClickException, match="Delivery configuration json"):
+        load_targets(tmp_path / "delivery_config.json", MagicMock())
+
+
+@pytest.mark.parametrize(
+    "options, name",
+    [
+        ({"max_workers": 0}, "max_workers"),
+        ({"retries": -1}, "retries"),
+        ({"retries": "twice"}, "retries"),
+        ({"backoff": None}, "backoff"),
+        ({"backoff": float("nan")}, "backoff"),
+    ],
+)
+def test_load_targets_invalid_options(tmp_path, options, name):
+    cfg = tmp_path / "delivery_config.json"
+    cfg.write_text(
+        json.dumps({**options, "targets": [{"type": "directory", "path": "books"}]})
+    )
+    with pytest.raises(click.ClickException, match=f"Invalid '{name}'"):
+        load_targets(cfg, MagicMock())
+
+
+def test_deliver_concurrently(epub_file):
+    # Every target waits for the others, so a sequential run would time out.
+    barrier = threading.Barrier(4, timeout=5)
+    targets = [FakeTarget(f"target-{i}") for i in range(4)]
+    for target in targets:
+        target.send = lambda *args: barrier.wait()
+
+    results = deliver(epub_file, "Author", "Title", "EPUB", targets, max_workers=4)
+
+    assert [r.target for r in results] == [t.name for t in targets]
+    assert all(r.ok for r in results)
+
+
+@pytest.mark.benchmark
+def test_deliver_concurrently_benchmark(epub_file):
+    targets = [FakeTarget(f"target-{i}", delay=0.3) for i in range(4)]
+
+    start = time.monotonic()
+    results = deliver(epub_file, "Author", "Title", "EPUB", targets, max_workers=4)
+
+    # Bounded by the slowest target, not the sum of all of them.
+    assert time.monotonic() - start < 0.9
+    assert all(r.ok for r in results)
+
+
+def test_deliver_retries_with_backoff(epub_file):
+    flaky = FakeTarget("flaky", failures=2)
+    broken = FakeTarget("broken", failures=10)
+
+    with patch("time.sleep") as mock_sleep:
+        results = deliver(
+            epub_file, "Author", "Title", "EPUB", [flaky, broken], retries=2
+        )
+
+    assert results[0].ok
+    assert results[0].attempts == 3
+    assert not results[1].ok
+    assert results[1].attempts == 3
+    assert results[1].error == "broken unavailable"
+    assert sorted(call.args[0] for call in mock_sleep.call_args_list) == [
+        1.0,
+        1.0,
+        2.0,
+        2.0,
+    ]
+
+
+def test_deliver_does_not_retry_permanent_errors(epub_file):
+    expired = FakeTarget("kindle", failures=10, error=click.ClickException)
+
+    with patch("time.sleep") as mock_sleep:
+        (result,) = deliver(epub_file, "Author", "Title", "EPUB", [expired])
+
+    assert not result.ok
+    assert result.attempts == 1
+    assert not mock_sleep.called
+
+
+def wrapped(error):
+    try:
+        raise error
+    except Exception as e:
+        try:
+            raise click.ClickException("Error whilst sending email") from e
+        except click.ClickException as wrapper:
+            return wrapper
+
+
+def kindle_api_error(code, tmp_path):
+    """Error raised by kindle_send for an HTTP error from Send-to-Kindle."""
+    cfg = tmp_path / "kindle_config.json"
+    cfg.write_text("{}")
+    http_error = urllib.error.HTTPError("https://example.com", code, "", {}, None)
+    with patch("readerlet.cli.stkclient.Client.load") as mock_load:
+        client = mock_load.return_value
+        client.get_owned_devices.return_value = []
+        client.send_file.side_effect = APIError("Upload failed", b"")
+        client.send_file.side_effect.__cause__ = http_error
+        with pytest.raises(click.ClickException) as excinfo:
+            kindle_send(tmp_path / "book.epub", "Author", "Title", "EPUB", cfg)
+    return excinfo.value
+
+
+@pytest.mark.parametrize(
+    "error, transient",
+    [
+        (ConnectionResetError(), True),
+        (TimeoutError(), True),
+        (urllib.error.URLError(ConnectionRefusedError()), True),
+        (wrapped(smtplib.SMTPServerDisconnected()), True),
+        (wrapped(smtplib.SMTPResponseException(421, b"Try again later")), True),
+        (wrapped(smtplib.SMTPAuthenticationError(535, b"Bad credentials")), False),
+        (click.ClickException("Re-authenticate with 'readerlet kindle-login'."), False),
+        (wrapped(FileNotFoundError()), False),
+        (urllib.error.HTTPError("https://example.com", 401, "", {}, None), False),
+        (wrapped(socket.timeout()), True),
+    ],
+)
+def test_is_transient(error, transient):
+    assert is_transient(error) is transient
+
+
+@pytest.mark.parametrize("code, transient", [(503, True), (429, True), (401, False)])
+def test_is_transient_kindle_http_errors(tmp_path, code, transient):
+    assert is_transient(kindle_api_error(code, tmp_path)) is transient
+
+
+def test_send_file_fan_out(epub_file, tmp_path):
+    runner = CliRunner()
+    output_dir = tmp_path / "books"
+    failing = FakeTarget("kindle:broken", failures=10)
+
+    with patch(
+        "readerlet.cli.load_targets",
+        return_value=([DirectoryTarget(output_dir)], {"max_workers": 2}),
+    ):
+        result = runner.invoke(cli, ["send", str(epub_file), "--fan-out"])
+
+    assert result.exit_code == 0
+    assert f"directory:{output_dir}: sent" in result.output
+    assert (output_dir / "Test-title.epub").read_bytes() == b"epub"
+
+    with patch(
+        "readerlet.cli.load_targets",
+        return_value=([DirectoryTarget(output_dir), failing], {"backoff": 0}),
+    ):
+        result = runner.invoke(cli, ["send", str(epub_file), "--fan-out"])
+
+    assert result.exit_code == 1
+    assert "kindle:broken: failed after 3 attempt(s)" in result.output
+    assert "Delivery failed for 1 of 2 targets." in result.output
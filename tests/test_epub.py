@@ -0,0 +1,168 @@
+import base64
+import io
+import os
+import time
+import tracemalloc
+from unittest.mock import patch
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+import pytest
+from PIL import Image
+
+from readerlet.article import Article
+from readerlet.epub import create_epub, get_environment, template_environment
+
+
+@pytest.fixture
+def article():
+    return Article(
+        "https://example.com",
+        "Test title",
+        "Test byline",
+        "en",
+        "<p>Test content</p>",
+        "Test text only content",
+    )
+
+
+def test_create_epub_contents(article, tmp_path):
+    epub_path = create_epub(article, str(tmp_path), False, for_kindle=False)
+
+    with ZipFile(epub_path) as archive:
+        names = archive.namelist()
+        assert names[0] == "mimetype"
+        assert archive.read("mimetype") == b"application/epub+zip"
+        assert "META-INF/container.xml" in names
+        assert "OEBPS/css/stylesheet.css" in names
+        assert "<p>Test content</p>" in archive.read("OEBPS/content.xhtml").decode()
+        assert "Test byline" in archive.read("OEBPS/content.opf").decode()
+
+
+def test_create_epub_memory_bounded_with_data_uri(article, tmp_path):
+    data = os.urandom(6 * 1024 * 1024)
+    encoded = base64.b64encode(data).decode()
+    article.content = (
+        "<p>Text</p>" * 1000 + f'<img src="data:image/png;base64,{encoded}">'
+    )
+    input_size = len(article.content)
+    del encoded
+
+    tracemalloc.start()
+    try:
+        epub_path = create_epub(article, str(tmp_path), False, for_kindle=False)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # The inlined image is decoded and archived in chunks, never held whole.
+    assert peak < 0.5 * input_size
+
+    with ZipFile(epub_path) as archive:
+        (image_name,) = [n for n in archive.namelist() if "/images/" in n]
+        assert archive.read(image_name) == data
+
+
+def jpeg_bytes(size=(1200, 900)):
+    buffer = io.BytesIO()
+    Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3)).save(
+        buffer, format="JPEG", quality=90
+    )
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def image_heavy_article(article):
+    images = [jpeg_bytes() for _ in range(6)]
+
+    def extract_images(self, temp_dir, for_kindle):
+        for i, data in enumerate(images):
+            (temp_dir / f"image-{i}.jpg").write_bytes(data)
+            self.images.append((f"image-{i}.jpg", "image/jpeg"))
+
+    with patch.object(Article, "extract_images", extract_images):
+        yield article
+
+
+def test_create_epub_compression_policy(image_heavy_article, tmp_path):
+    epub_path = create_epub(
+        image_heavy_article, str(tmp_path), False, for_kindle=False, compresslevel=9
+    )
+
+    with ZipFile(epub_path) as archive:
+        for info in archive.infolist():
+            if info.filename.endswith(".jpg") or info.filename == "mimetype":
+                assert info.compress_type == ZIP_STORED
+            else:
+                assert info.compress_type == ZIP_DEFLATED
+
+
+def build_with_and_without_stored_media(article, tmp_path):
+    results = {}
+    for store_media in (True, False):
+        output_dir = tmp_path / str(store_media)
+        output_dir.mkdir()
+        article.images = []
+        start = time.perf_counter()
+        epub_path = create_epub(
+            article, str(output_dir), False, for_kindle=False, store_media=store_media
+        )
+        results[store_media] = (epub_path, time.perf_counter() - start)
+    return results
+
+
+def test_create_epub_store_media_disabled(image_heavy_article, tmp_path):
+    results = build_with_and_without_stored_media(image_heavy_article, tmp_path)
+    (stored_path, _), (deflated_path, _) = results[True], results[False]
+
+    with ZipFile(deflated_path) as archive:
+        for info in archive.infolist():
+            if info.filename == "mimetype":
+                assert info.compress_type == ZIP_STORED
+            else:
+                assert info.compress_type == ZIP_DEFLATED
+
+    # Deflating JPEGs gains next to nothing.
+    assert stored_path.stat().st_size < deflated_path.stat().st_size * 1.01
+
+
+@pytest.mark.benchmark
+def test_create_epub_compression_benchmark(image_heavy_article, tmp_path):
+    results = build_with_and_without_stored_media(image_heavy_article, tmp_path)
+    (_, stored_time), (_, deflated_time) = results[True], results[False]
+
+    # Deflating JPEGs costs roughly 10x the build time.
+    assert stored_time < deflated_time
+
+
+def test_template_environment_reused(template_dirs):
+    env = get_environment()
+    assert get_environment() is env
+    assert env.get_template("content.xhtml") is env.get_template("content.xhtml")
+
+
+def test_template_bytecode_cache_opt_in(template_dirs):
+    _, cache_dir = template_dirs
+    get_environment().get_template("content.opf")
+    assert not cache_dir.exists()
+
+    cache_dir.mkdir()
+    template_environment.cache_clear()
+    get_environment().get_template("content.opf")
+    assert list(cache_dir.glob("__jinja2_*.cache"))
+
+
+def test_create_epub_user_template_override(article, template_dirs):
+    override_dir, _ = template_dirs
+    override_dir.mkdir()
+    (override_dir / "content.xhtml").write_text(
+        "<html><body><h1>Custom</h1>{{ article.content | safe }}</body></html>"
+    )
+    (override_dir / "stylesheet.css").write_text("body { margin: 0; }")
+
+    epub_path = create_epub(article, str(override_dir.parent), False, False)
+
+    with ZipFile(epub_path) as archive:
+        content = archive.read("OEBPS/content.xhtml").decode()
+        assert content.startswith("<html><body><h1>Custom</h1><p>Test content</p>")
+        assert archive.read("OEBPS/css/stylesheet.css") == b"body { margin: 0; }"
+        assert "Test byline" in archive.read("OEBPS/content.opf").decode()
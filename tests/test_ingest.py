@@ -0,0 +1,258 @@
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import click
+import pytest
+from click.testing import CliRunner
+
+from readerlet.article import Article
+from readerlet.cli import ContentRejected, PageNotReaderable, cli
+from readerlet.ingest import (
+    StateStore,
+    content_hash,
+    load_source,
+    parse_feed,
+    parse_link_list,
+)
+
+RSS_FEED = """<?xml version="1.0"?>
+<rss version="2.0">
+  <channel>
+    <title>Feed</title>
+    <item><title>One</title><link>https://example.com/one</link></item>
+    <item><title>Two</title><link> https://example.com/two </link></item>
+    <item><title>One again</title><link>https://example.com/one</link></item>
+  </channel>
+</rss>"""
+
+ATOM_FEED = """<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+  <entry>
+    <link rel="self" href="https://example.com/feed/one"/>
+    <link href="/one"/>
+  </entry>
+  <entry><link rel="alternate" href="https://example.com/two"/></entry>
+</feed>"""
+
+BOOKMARKS = """<!DOCTYPE NETSCAPE-Bookmark-file-1>
+<DL><p>
+  <DT><A HREF="https://example.com/one">One</A>
+  <DT><A HREF="javascript:void(0)">Bookmarklet</A>
+  <DT><A HREF="https://example.com/two">Two</A>
+</DL>"""
+
+
+def test_parse_rss_feed():
+    assert parse_feed(RSS_FEED) == [
+        "https://example.com/one",
+        "https://example.com/two",
+    ]
+
+
+def test_parse_atom_feed():
+    assert parse_feed(ATOM_FEED, "https://example.com/feed") == [
+        "https://example.com/one",
+        "https://example.com/two",
+    ]
+
+
+def test_parse_bookmarks_export():
+    assert parse_link_list(BOOKMARKS) == [
+        "https://example.com/one",
+        "https://example.com/two",
+    ]
+
+
+def test_load_source_rejects_html_page():
+    page = """<!DOCTYPE html>
+<html><body>
+  <a href="/about">About</a> <a href="/login">Log in</a>
+  <a href="https://twitter.com/x">Twitter</a>
+</body></html>"""
+    with patch("requests.get") as mock_get:
+        mock_get.return_value.content = page.encode()
+        mock_get.return_value.text = page
+        with pytest.raises(click.ClickException, match="Not a feed or link list"):
+            load_source("https://blog.example.com/")
+
+
+def test_parse_plain_link_list():
+    text = "https://example.com/one\n\n# comment\nhttps://example.com/two\n"
+    assert parse_link_list(text) == [
+        "https://example.com/one",
+        "https://example.com/two",
+    ]
+
+
+def test_load_source_feed_with_bom(tmp_path):
+    feed = tmp_path / "feed.xml"
+    feed.write_bytes(b"\xef\xbb\xbf" + RSS_FEED.encode())
+    assert load_source(str(feed)) == [
+        "https://example.com/one",
+        "https://example.com/two",
+    ]
+
+
+def test_load_source_feed_uses_declared_encoding():
+    feed = RSS_FEED.replace(
+        '<?xml version="1.0"?>', '<?xml version="1.0" encoding="ISO-8859-1"?>'
+    ).replace("/two", "/caf\xe9")
+    with patch("requests.get") as mock_get:
+        mock_get.return_value.content = feed.encode("latin-1")
+        # Decoded with the wrong charset, e.g. from a bare text/xml header.
+        mock_get.return_value.text = feed.encode("latin-1").decode("utf-8", "replace")
+        links = load_source("https://example.com/feed")
+
+    assert links == ["https://example.com/one", "https://example.com/caf\xe9"]
+
+
+def test_state_store(tmp_path):
+    db_path = tmp_path / "state" / "state.db"
+    with StateStore(db_path) as store:
+        assert not store.is_processed("https://example.com/one")
+        store.record("https://example.com/one", content_hash("<p>One</p>"))
+
+    with StateStore(db_path) as store:
+        assert store.is_processed("https://example.com/one")
+        assert store.has_hash(content_hash("<p>One</p>"))
+        assert not store.has_hash(content_hash("<p>Two</p>"))
+
+
+def test_state_store_records_utc_time(tmp_path, monkeypatch):
+    monkeypatch.setenv("TZ", "Asia/Tokyo")
+    time.tzset()
+    try:
+        with StateStore(tmp_path / "state.db") as store:
+            store.record("https://example.com/one")
+            (processed_at,) = store.connection.execute(
+                "SELECT processed_at FROM processed"
+            ).fetchone()
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+    recorded = datetime.strptime(processed_at, "%Y-%m-%dT%H:%M:%SZ")
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    assert abs(now - recorded) < timedelta(minutes=1)
+
+
+@pytest.fixture
+def feed_file(tmp_path):
+    feed = tmp_path / "feed.xml"
+    feed.write_text(RSS_FEED)
+    return feed
+
+
+@pytest.fixture
+def state_path(tmp_path):
+    with patch(
+        "readerlet.cli.default_state_path", return_value=tmp_path / "state.db"
+    ) as mock_path:
+        yield mock_path.return_value
+
+
+def make_article(url, *args, **kwargs):
+    return Article(url, "Title", "Byline", "en", "<p>Same content</p>", "")
+
+
+def test_ingest_sends_only_new_items(feed_file, state_path):
+    runner = CliRunner()
+    with StateStore(state_path) as store:
+        store.record("https://example.com/one", content_hash("<p>Other</p>"))
+
+    with patch("readerlet.cli.install_npm_packages"), patch(
+        "readerlet.cli.extract_content", side_effect=make_article
+    ) as mock_extract, patch("readerlet.cli.send_article") as mock_send:
+        result = runner.invoke(cli, ["ingest", str(feed_file)])
+
+    assert result.exit_code == 0
+    assert "Found 2 items, 1 new." in result.output
+    mock_extract.assert_called_once_with(
+        "https://example.com/two",
+        fields=("content",),
+        precheck=True,
+        min_length=500,
+        max_link_density=0.5,
+    )
+    assert mock_send.call_count == 1
+
+    with StateStore(state_path) as store:
+        assert store.is_processed("https://example.com/two")
+
+
+def test_ingest_skips_duplicate_content(feed_file, state_path):
+    runner = CliRunner()
+    with patch("readerlet.cli.install_npm_packages"), patch(
+        "readerlet.cli.extract_content", side_effect=make_article
+    ), patch("readerlet.cli.send_article") as mock_send:
+        result = runner.invoke(cli, ["ingest", str(feed_file)])
+
+    assert result.exit_code == 0
+    assert mock_send.call_count == 1
+    assert "Sent: 1, duplicates skipped: 1, rejected: 0, failed: 0." in result.output
+
+
+def test_ingest_mark_only(feed_file, state_path):
+    runner = CliRunner()
+    with patch("readerlet.cli.extract_content") as mock_extract:
+        result = runner.invoke(cli, ["ingest", str(feed_file), "--mark-only"])
+        assert not mock_extract.called
+
+    assert "Marked 2 items as processed." in result.output
+    result = runner.invoke(cli, ["ingest", str(feed_file)])
+    assert "Found 2 items, 0 new." in result.output
+
+
+def test_ingest_records_rejected_pages(feed_file, state_path):
+    runner = CliRunner()
+    with patch("readerlet.cli.install_npm_packages"), patch(
+        "readerlet.cli.extract_content",
+        side_effect=PageNotReaderable("Page does not look like an article."),
+    ), patch("readerlet.cli.send_article") as mock_send:
+        result = runner.invoke(cli, ["ingest", str(feed_file), "--min-length", "0"])
+
+    assert not mock_send.called
+    assert "Sent: 0, duplicates skipped: 0, rejected: 2, failed: 0." in result.output
+    with StateStore(state_path) as store:
+        assert store.is_processed("https://example.com/one")
+
+
+def test_ingest_retries_below_threshold_pages_with_looser_limits(feed_file, state_path):
+    runner = CliRunner()
+    with patch("readerlet.cli.install_npm_packages"), patch(
+        "readerlet.cli.extract_content",
+        side_effect=ContentRejected("Content too short: 120 characters."),
+    ) as mock_extract:
+        result = runner.invoke(cli, ["ingest", str(feed_file)])
+        assert "rejected: 2" in result.output
+
+        # Same or stricter limits: not fetched again.
+        result = runner.invoke(cli, ["ingest", str(feed_file), "--min-length", "600"])
+        assert "Found 2 items, 0 new." in result.output
+        assert mock_extract.call_count == 2
+
+        result = runner.invoke(cli, ["ingest", str(feed_file), "--min-length", "100"])
+        assert "Found 2 items, 2 new." in result.output
+        assert mock_extract.call_count == 4
+
+
+def test_state_store_adds_limit_columns(tmp_path):
+    db_path = tmp_path / "state.db"
+    connection = sqlite3.connect(db_path)
+    connection.execute(
+        "CREATE TABLE processed "
+        "(url TEXT PRIMARY KEY, content_hash TEXT, processed_at TEXT)"
+    )
+    connection.execute(
+        "INSERT INTO processed VALUES ('https://example.com/one', NULL, NULL)"
+    )
+    connection.commit()
+    connection.close()
+
+    with StateStore(db_path) as store:
+        assert store.is_processed("https://example.com/one")
+        store.record("https://example.com/two", min_length=500, max_link_density=0.5)
+        assert store.is_processed("https://example.com/two", 500, 0.5)
+        assert not store.is_processed("https://example.com/two", 500, 0.8)
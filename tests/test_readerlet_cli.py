@@ -1,3 +1,4 @@
+import json
 from pathlib import Path
 from unittest.mock import patch
 
@@ -77,6 +78,46 @@ def test_extract_print_content_text_to_stdout(article):
         assert result.output == "Test text only content\n"
 
 
+def test_extract_print_paragraphs_to_stdout(article):
+    runner = CliRunner()
+    with patch("readerlet.cli.extract_content") as mock_extract:
+        mock_extract.return_value = article
+        result = runner.invoke(
+            cli, ["extract", "https://example.com", "-o", "text", "-p"]
+        )
+        assert result.output == "Link test\n"
+        assert mock_extract.call_args[0][1] == ["content"]
+
+
+def test_extract_paragraphs_requires_text_output(article):
+    runner = CliRunner()
+    with patch("readerlet.cli.extract_content") as mock_extract:
+        mock_extract.return_value = article
+        result = runner.invoke(
+            cli, ["extract", "https://example.com", "-o", "html", "-p"]
+        )
+        assert result.exit_code == 2
+        assert "Flag -p can only be used with '-o text'." in result.output
+
+
+def test_extract_print_jsonl_to_stdout(article):
+    runner = CliRunner()
+    article.content = "<p>First</p><p>Second</p>"
+    with patch("readerlet.cli.extract_content") as mock_extract:
+        mock_extract.return_value = article
+        result = runner.invoke(cli, ["extract", "https://example.com", "-o", "jsonl"])
+        records = [json.loads(line) for line in result.output.splitlines()]
+        assert [r["text"] for r in records] == ["First", "Second"]
+        assert records[1] == {
+            "url": "https://example.com",
+            "title": "Test title",
+            "byline": "Test byline",
+            "lang": "en",
+            "paragraph": 1,
+            "text": "Second",
+        }
+
+
 @patch("readerlet.cli.extract_content")
 def test_send_kindle_config_file_not_found(mock_extract, article):
     runner = CliRunner()